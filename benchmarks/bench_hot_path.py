@@ -0,0 +1,317 @@
+"""Microbenchmarks for the detect_falls.py message hot path.
+
+Generates synthetic scenescape/regulated/scene messages for the calibrations
+in dataset/cameras.json and times on_message, project_canonical_bboxes, the
+rolling-window "history" stage of each message and JSON encode/decode
+separately. Each run is
+appended to a JSON lines results file and compared with the previous run that
+used the same parameters, so regressions between versions stand out.
+
+    python3 benchmarks/bench_hot_path.py --people 5,50,200 --cameras 2 --rate 15
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import types
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, HERE)
+
+import transform_standin  # noqa: E402
+
+transform_standin.install()
+
+import detect_falls  # noqa: E402
+
+DEFAULT_CAMERAS = os.path.join(REPO_ROOT, "dataset", "cameras.json")
+DEFAULT_RESULTS = os.path.join(HERE, "results", "hot_path.jsonl")
+SCENE_ID = "00000000-0000-0000-0000-000000000bench"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the fall detection hot path")
+    parser.add_argument('--people', type=str, default="5,50,200",
+                        help='Comma separated people counts to benchmark')
+    parser.add_argument('--cameras', type=int, default=2,
+                        help='Number of cameras; dataset cameras are replicated if needed')
+    parser.add_argument('--rate', type=float, default=15.0,
+                        help='Simulated scene message rate (messages per second)')
+    parser.add_argument('--messages', type=int, default=500,
+                        help='Timed messages per people count')
+    parser.add_argument('--warmup', type=int, default=50,
+                        help='Untimed messages before measuring')
+    parser.add_argument('--json-backend', choices=['auto', 'orjson', 'json'], default='auto',
+                        help='JSON backend passed to detect_falls.JsonCodec')
+    parser.add_argument('--selective-decode', action='store_true',
+                        help='Benchmark selective scene decoding')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--camera-file', type=str, default=DEFAULT_CAMERAS,
+                        help='Camera calibrations in dataset/cameras.json format')
+    parser.add_argument('--results', type=str, default=DEFAULT_RESULTS,
+                        help='JSON lines file the results are appended to')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not append this run to the results file')
+    parser.add_argument('--regression-threshold', type=float, default=0.10,
+                        help='Relative p50 slowdown reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='Exit with status 1 when a regression is detected')
+    return parser.parse_args()
+
+def load_calibrations(path, camera_count):
+    with open(path) as f:
+        cameras = json.load(f)["cameras"]
+    calibrations = {}
+    for i in range(camera_count):
+        cam = cameras[i % len(cameras)]
+        name = cam["name"] if i < len(cameras) else f"{cam['name']}-{i}"
+        # Replicas are nudged sideways so every camera gets its own pose
+        offset = 0.25 * (i // len(cameras))
+        translation = list(cam["extrinsics"]["translation"])
+        translation[0] += offset
+        calibrations[name] = {
+            "extrinsics": {
+                "translation": translation,
+                "rotation": cam["extrinsics"]["rotation"],
+                "scale": cam["extrinsics"]["scale"],
+            },
+            "intrinsics": cam["intrinsics"],
+            "distortion": cam["distortion"],
+            "resolution": cam["resolution"],
+        }
+    return calibrations
+
+class SimulatedClock:
+    """Replaces detect_falls.time so rolling windows see the simulated rate."""
+
+    perf_counter = staticmethod(time.perf_counter)
+
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+class SyntheticScene:
+    """People wandering over the lawn, each seen by one camera per message."""
+
+    def __init__(self, people, calibrations, rate, rng):
+        self.rng = rng
+        self.rate = rate
+        self.calibrations = calibrations
+        self.cache = detect_falls.CalibrationCache(calibrations)
+        self.cam_ids = list(calibrations)
+        self.people = []
+        for i in range(people):
+            behaviour = rng.choice(["standing", "walking", "walking", "running", "fallen"])
+            speed = {"standing": 0.05, "walking": 0.8, "running": 2.0, "fallen": 0.0}[behaviour]
+            heading = rng.uniform(0, 2 * np.pi)
+            self.people.append({
+                "id": f"person-{i:05d}",
+                "behaviour": behaviour,
+                "position": np.array([rng.uniform(1, 9), rng.uniform(1, 9), 0.0]),
+                "velocity": np.array([speed * np.cos(heading), speed * np.sin(heading), 0.0]),
+                "size": [rng.uniform(0.4, 0.6), rng.uniform(0.3, 0.5), rng.uniform(1.55, 1.95)],
+                "cam_id": self.cam_ids[i % len(self.cam_ids)],
+            })
+        self.sequence = 0
+
+    def _detected_bbox(self, person):
+        camera = self.cache.get(person["cam_id"])
+        width, height = self.calibrations[person["cam_id"]]["resolution"]
+        box = detect_falls.project_canonical_bboxes(person["position"], person["size"], camera)[0]
+        if np.isnan(box[0]):
+            box = np.array([self.rng.uniform(0, width - 80), self.rng.uniform(0, height - 200), 0, 0])
+            box[2:] = box[:2] + [60, 180]
+        x_min, y_min, x_max, y_max = box
+        if person["behaviour"] == "fallen":
+            # Lying down: wider and much shorter than the standing projection
+            y_min = y_max - 0.35 * (y_max - y_min)
+            x_max = x_min + 2.5 * (x_max - x_min)
+        jitter = self.rng.uniform(-2, 2)
+        x_min = min(max(x_min + jitter, 0.0), width - 2)
+        y_min = min(max(y_min + jitter, 0.0), height - 2)
+        x_max = min(max(x_max, x_min + 2), width)
+        y_max = min(max(y_max, y_min + 2), height)
+        return {"x": x_min, "y": y_min, "width": x_max - x_min, "height": y_max - y_min}
+
+    def next_payload(self):
+        objects = []
+        for person in self.people:
+            person["position"] += person["velocity"] / self.rate
+            for axis in (0, 1):
+                if not 0.5 < person["position"][axis] < 9.5:
+                    person["velocity"][axis] *= -1
+            objects.append({
+                "id": person["id"],
+                "category": "person",
+                "type": "person",
+                "translation": person["position"].tolist(),
+                "velocity": person["velocity"].tolist(),
+                "size": person["size"],
+                "rotation": [0, 0, 0, 1],
+                "visibility": [person["cam_id"]],
+                "bounding_box_px": self._detected_bbox(person),
+                "bounding_box_camera_id": person["cam_id"],
+            })
+        self.sequence += 1
+        return json.dumps({
+            "id": SCENE_ID,
+            "name": "bench",
+            "timestamp": datetime.datetime.fromtimestamp(
+                self.sequence / self.rate, datetime.timezone.utc).isoformat(),
+            "objects": objects,
+        }).encode("utf-8")
+
+class CapturingClient:
+    def __init__(self):
+        self.last_payload = None
+        self.published = 0
+
+    def publish(self, topic, payload=None, *args, **kwargs):
+        self.last_payload = payload
+        self.published += 1
+
+def summarize(samples):
+    samples = np.asarray(samples)
+    return {
+        "p50_us": float(np.percentile(samples, 50) * 1e6),
+        "p99_us": float(np.percentile(samples, 99) * 1e6),
+        "ops_per_sec": float(len(samples) / samples.sum()) if samples.sum() > 0 else 0.0,
+        "samples": int(len(samples)),
+    }
+
+class StageRecorder(detect_falls.MetricsRegistry):
+    """Keeps the per-stage timings of the last processed message."""
+
+    def observe_stages(self, timings):
+        self.last_stages = dict(timings)
+        super().observe_stages(timings)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def bench_people(people, args, calibrations):
+    rng = random.Random(args.seed)
+    scene = SyntheticScene(people, calibrations, args.rate, rng)
+    clock = SimulatedClock(1.7e9)
+    real_time = detect_falls.time
+    detect_falls.time = clock
+    detect_falls_args = detect_falls.parse_args([
+        "--scene-uuid", SCENE_ID, "--broker", "localhost", "--resturl", "http://localhost"])
+    scene_state = detect_falls.SceneState(SCENE_ID, calibrations)
+    userdata = {
+        "mqtt_topic": f"scenescape/regulated/scene/{SCENE_ID}",
+        "scenes": {SCENE_ID: scene_state},
+        "ignored_scenes": set(),
+        "codec": detect_falls.JsonCodec(args.json_backend, args.selective_decode),
+        "metrics": StageRecorder(),
+        "started_at": clock.time(),
+        "args": detect_falls_args,
+    }
+    codec = userdata["codec"]
+    client = CapturingClient()
+    timings = {"on_message": [], "project_canonical_bboxes": [], "history": [],
+               "json_decode": [], "json_encode": []}
+    try:
+        for i in range(args.warmup + args.messages):
+            clock.now += 1.0 / args.rate
+            payload = scene.next_payload()
+            msg = types.SimpleNamespace(topic=userdata["mqtt_topic"], payload=payload)
+            elapsed = timed(detect_falls.on_message, client, userdata, msg)
+            if i < args.warmup:
+                continue
+            timings["on_message"].append(elapsed)
+            timings["history"].append(userdata["metrics"].last_stages["history"])
+
+            start = time.perf_counter()
+            data = codec.decode_scene(payload)
+            timings["json_decode"].append(time.perf_counter() - start)
+
+            published = json.loads(client.last_payload)
+            timings["json_encode"].append(timed(codec.dumps, published))
+
+            obj = data["objects"][i % len(data["objects"])]
+            camera = scene_state.calibration_cache.get(obj["bounding_box_camera_id"])
+            timings["project_canonical_bboxes"].append(timed(
+                detect_falls.project_canonical_bboxes, obj["translation"], obj["size"], camera))
+    finally:
+        detect_falls.time = real_time
+    return {name: summarize(samples) for name, samples in timings.items()}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_previous(path, params):
+    previous = None
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("params") == params:
+                    previous = record
+    return previous
+
+def report(params, results, previous, threshold):
+    print(f"\npeople={params['people']} cameras={params['cameras']} rate={params['rate']}/s")
+    if previous:
+        print(f"compared with {previous.get('commit') or 'unknown'} at {previous['time']}")
+    print(f"{'benchmark':<32}{'p50 us':>12}{'p99 us':>12}{'ops/s':>12}{'p50 change':>12}")
+    regressions = []
+    for name, stats in results.items():
+        change = ""
+        old = (previous or {}).get("results", {}).get(name)
+        if old and old["p50_us"] > 0:
+            delta = stats["p50_us"] / old["p50_us"] - 1
+            change = f"{delta:+.1%}"
+            if delta > threshold:
+                change += " !"
+                regressions.append(name)
+        print(f"{name:<32}{stats['p50_us']:>12.1f}{stats['p99_us']:>12.1f}"
+              f"{stats['ops_per_sec']:>12.0f}{change:>12}")
+    return regressions
+
+def main():
+    args = parse_args()
+    calibrations = load_calibrations(args.camera_file, args.cameras)
+    regressions = []
+    for people in [int(p) for p in args.people.split(",") if p]:
+        params = {"people": people, "cameras": args.cameras, "rate": args.rate,
+                  "messages": args.messages, "seed": args.seed,
+                  "json_backend": detect_falls.JsonCodec(args.json_backend).backend,
+                  "selective_decode": args.selective_decode}
+        results = bench_people(people, args, calibrations)
+        previous = load_previous(args.results, params)
+        regressions += report(params, results, previous, args.regression_threshold)
+        if not args.no_save:
+            os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+            with open(args.results, "a") as f:
+                f.write(json.dumps({
+                    "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "params": params,
+                    "results": results,
+                }) + "\n")
+    if regressions:
+        print(f"\nRegressions over {args.regression_threshold:.0%}: {', '.join(sorted(set(regressions)))}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Startup benchmark for detect_falls.py.
+
+Spawns the detector as a fresh interpreter and measures, from the moment the
+process is started, how long it takes to import detect_falls, to subscribe
+to the scene topic and to publish its first summary. The REST API is served
+locally from dataset/cameras.json; subscribe and first publish need an MQTT
+broker with TLS (as detect_falls.py always uses TLS), given with --broker.
+Runs with and without a calibration snapshot are reported separately.
+Results are appended to a JSON lines file and compared with the previous run
+using the same parameters, as in bench_hot_path.py.
+
+    python3 benchmarks/bench_startup.py --broker localhost --port 1883 --runs 5
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from bench_hot_path import (DEFAULT_CAMERAS, SCENE_ID, SyntheticScene,  # noqa: E402
+                            git_commit, load_calibrations, load_previous)
+import detect_falls  # noqa: E402
+
+DEFAULT_RESULTS = os.path.join(HERE, "results", "startup.jsonl")
+DETECTOR = os.path.join(REPO_ROOT, "detect_falls.py")
+
+# Installs the scene_common.transform stand-in only where the real one is missing
+BOOTSTRAP = """
+import importlib.util, runpy, sys
+sys.path[:0] = [{here!r}, {repo!r}]
+if importlib.util.find_spec("scene_common") is None:
+    import transform_standin
+    transform_standin.install()
+sys.argv = ["detect_falls.py"] + sys.argv[1:]
+{body}
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark fall detection startup time")
+    parser.add_argument('--broker', type=str, default=None,
+                        help='TLS MQTT broker for the subscribe and first publish phases '
+                             '(only the import phase is measured without one)')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--controller-auth', type=str, default=None,
+                        help='Broker credentials for the detector (default: dummy credentials)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Runs per phase; the median is reported')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Seconds to wait for the detector to publish')
+    parser.add_argument('--camera-file', type=str, default=DEFAULT_CAMERAS,
+                        help='Camera calibrations in dataset/cameras.json format')
+    parser.add_argument('--results', type=str, default=DEFAULT_RESULTS,
+                        help='JSON lines file the results are appended to')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not append this run to the results file')
+    parser.add_argument('--regression-threshold', type=float, default=0.10,
+                        help='Relative median slowdown reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='Exit with status 1 when a regression is detected')
+    return parser.parse_args()
+
+def serve_cameras(camera_file):
+    """Serves /cameras and /scenes in SceneScape REST format; returns the base URL."""
+    with open(camera_file) as f:
+        cameras = json.load(f)["cameras"]
+    results = [{"uid": cam["uid"], "name": cam["name"], **cam["extrinsics"],
+                "intrinsics": cam["intrinsics"], "distortion": cam["distortion"],
+                "resolution": cam["resolution"]} for cam in cameras]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/scenes"):
+                body = {"results": [{"uid": SCENE_ID}], "next": None}
+            else:
+                body = {"results": results}
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def time_import():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", BOOTSTRAP.format(
+        here=HERE, repo=REPO_ROOT, body="import detect_falls")], check=True)
+    return time.perf_counter() - start
+
+def time_run(args, resturl, auth_path, snapshot_dir, calibrations):
+    """Returns (seconds to subscribe, seconds to first publish) for one detector run."""
+    received = threading.Event()
+    client = detect_falls.initialize_mqtt_client()
+    client.tls_set(cert_reqs=ssl.CERT_NONE)
+    client.tls_insecure_set(True)
+    with open(auth_path) as f:
+        auth = json.load(f)
+    client.username_pw_set(auth["user"], auth["password"])
+    client.on_message = lambda c, u, msg: received.set()
+    client.connect(args.broker, args.port, 60)
+    client.subscribe(f"scenescape/fall-detection/{SCENE_ID}")
+    client.loop_start()
+
+    command = [sys.executable, "-u", "-c", BOOTSTRAP.format(
+        here=HERE, repo=REPO_ROOT, body=f'runpy.run_path({DETECTOR!r}, run_name="__main__")'),
+        "--broker", args.broker, "--port", str(args.port), "--resturl", resturl,
+        "--scene-uuid", SCENE_ID, "--controller-auth", auth_path,
+        "--calibration-snapshot-dir", snapshot_dir, "--calibration-refresh", "0"]
+    env = dict(os.environ, SCENESCAPE_API_KEY="benchmark-key")
+    scene = SyntheticScene(5, calibrations, 15.0, random.Random(0))
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True, env=env)
+    subscribed = None
+    try:
+        for line in process.stdout:
+            if line.startswith("Subscribing to topic"):
+                subscribed = time.perf_counter() - start
+                break
+        if subscribed is None:
+            raise RuntimeError("detector exited before subscribing")
+        threading.Thread(target=lambda: [None for _ in process.stdout], daemon=True).start()
+        deadline = time.perf_counter() + args.timeout
+        while not received.is_set():
+            if time.perf_counter() > deadline:
+                raise RuntimeError("timed out waiting for the first summary")
+            client.publish(f"scenescape/regulated/scene/{SCENE_ID}", scene.next_payload())
+            received.wait(0.01)
+        published = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+        client.loop_stop()
+        client.disconnect()
+    return subscribed, published
+
+def summarize(samples):
+    return {"median_ms": float(np.median(samples) * 1e3),
+            "min_ms": float(np.min(samples) * 1e3),
+            "runs": len(samples)}
+
+def main():
+    args = parse_args()
+    results = {"import": summarize([time_import() for _ in range(args.runs)])}
+    if args.broker:
+        resturl = serve_cameras(args.camera_file)
+        calibrations = load_calibrations(args.camera_file, 2)
+        with tempfile.TemporaryDirectory() as tmp:
+            auth_path = args.controller_auth
+            if auth_path is None:
+                auth_path = os.path.join(tmp, "controller.auth")
+                with open(auth_path, "w") as f:
+                    json.dump({"user": "benchmark", "password": "benchmark"}, f)
+            for variant in ("rest", "snapshot"):
+                subscribe, publish = [], []
+                for _ in range(args.runs):
+                    # "rest" starts without a snapshot every run; "snapshot" reuses the one saved
+                    snapshot_dir = os.path.join(tmp, "snapshots-" + variant)
+                    if variant == "rest" and os.path.isdir(snapshot_dir):
+                        for name in os.listdir(snapshot_dir):
+                            os.remove(os.path.join(snapshot_dir, name))
+                    if variant == "snapshot" and not os.path.isdir(snapshot_dir):
+                        time_run(args, resturl, auth_path, snapshot_dir, calibrations)
+                    s, p = time_run(args, resturl, auth_path, snapshot_dir, calibrations)
+                    subscribe.append(s)
+                    publish.append(p)
+                results[f"subscribe_{variant}"] = summarize(subscribe)
+                results[f"first_publish_{variant}"] = summarize(publish)
+
+    params = {"runs": args.runs, "broker": bool(args.broker)}
+    previous = load_previous(args.results, params)
+    if previous:
+        print(f"compared with {previous.get('commit') or 'unknown'} at {previous['time']}")
+    print(f"{'phase':<28}{'median ms':>12}{'min ms':>12}{'change':>12}")
+    regressions = []
+    for name, stats in results.items():
+        change = ""
+        old = (previous or {}).get("results", {}).get(name)
+        if old and old["median_ms"] > 0:
+            delta = stats["median_ms"] / old["median_ms"] - 1
+            change = f"{delta:+.1%}"
+            if delta > args.regression_threshold:
+                change += " !"
+                regressions.append(name)
+        print(f"{name:<28}{stats['median_ms']:>12.1f}{stats['min_ms']:>12.1f}{change:>12}")
+    if not args.no_save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        with open(args.results, "a") as f:
+            f.write(json.dumps({
+                "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "params": params,
+                "results": results,
+            }) + "\n")
+    if regressions:
+        print(f"\nRegressions over {args.regression_threshold:.0%}: {', '.join(regressions)}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Memory benchmark for the per-person state kept in SceneState.
+
+Feeds synthetic scene messages (see bench_hot_path.py) through
+process_scene_message and reports, once the rolling windows are warm:
+
+- bytes per tracked person: everything reachable from scene.tracked_people
+  and the rolling-window history store, each object counted once
+- history bytes per tracked person: the part of that held by the history store
+- blocks per frame: memory blocks a frame leaves allocated for tracker state,
+  measured with sys.getallocatedblocks() while the previous state is pinned
+  and the published summary has been dropped
+- the mean process_scene_message time
+
+    python3 benchmarks/bench_track_memory.py --people 50,200,1000
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import types
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from bench_hot_path import (DEFAULT_CAMERAS, SCENE_ID, SimulatedClock,  # noqa: E402
+                            SyntheticScene, git_commit, load_calibrations, load_previous)
+import detect_falls  # noqa: E402
+
+DEFAULT_RESULTS = os.path.join(HERE, "results", "track_memory.jsonl")
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark memory held by fall detection tracks")
+    parser.add_argument('--people', type=str, default="50,200,1000",
+                        help='Comma separated people counts to benchmark')
+    parser.add_argument('--cameras', type=int, default=2,
+                        help='Number of cameras; dataset cameras are replicated if needed')
+    parser.add_argument('--rate', type=float, default=15.0,
+                        help='Simulated scene message rate (messages per second)')
+    parser.add_argument('--messages', type=int, default=30,
+                        help='Measured messages per people count')
+    parser.add_argument('--warmup', type=int, default=30,
+                        help='Messages processed before measuring')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--camera-file', type=str, default=DEFAULT_CAMERAS,
+                        help='Camera calibrations in dataset/cameras.json format')
+    parser.add_argument('--results', type=str, default=DEFAULT_RESULTS,
+                        help='JSON lines file the results are appended to')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not append this run to the results file')
+    return parser.parse_args()
+
+def reachable(roots):
+    """Returns every object reachable from roots, each once."""
+    seen = {}
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SKIPPED_TYPES):
+            continue
+        seen[id(obj)] = obj
+        stack.extend(gc.get_referents(obj))
+    return list(seen.values())
+
+def object_size(obj):
+    if isinstance(obj, np.ndarray) and obj.base is None:
+        return obj.nbytes
+    return sys.getsizeof(obj)
+
+def bench_people(people, args, calibrations):
+    scene = SyntheticScene(people, calibrations, args.rate, random.Random(args.seed))
+    clock = SimulatedClock(1.7e9)
+    real_time = detect_falls.time
+    detect_falls.time = clock
+    detect_falls_args = detect_falls.parse_args([
+        "--scene-uuid", SCENE_ID, "--broker", "localhost", "--resturl", "http://localhost"])
+    codec = detect_falls.JsonCodec("json")
+    state = detect_falls.SceneState(SCENE_ID, calibrations)
+    blocks, seconds = [], []
+    try:
+        for i in range(args.warmup + args.messages):
+            clock.now += 1.0 / args.rate
+            data = codec.decode_scene(scene.next_payload())
+            if i < args.warmup:
+                detect_falls.process_scene_message(state, data, detect_falls_args)
+                continue
+            pinned = reachable(state.tracked_people.values())
+            gc.disable()
+            before = sys.getallocatedblocks()
+            start = time.perf_counter()
+            message = detect_falls.process_scene_message(state, data, detect_falls_args)
+            seconds.append(time.perf_counter() - start)
+            del message
+            blocks.append(sys.getallocatedblocks() - before)
+            gc.enable()
+            del pinned
+        track_objects = reachable(state.tracked_people.values())
+        shared = {id(obj) for obj in track_objects}
+        history_objects = [obj for obj in reachable([state.history]) if id(obj) not in shared]
+        track_size = sum(map(object_size, track_objects))
+        history_size = sum(map(object_size, history_objects))
+    finally:
+        detect_falls.time = real_time
+    tracked = max(len(state.tracked_people), 1)
+    return {
+        "bytes_per_person": (track_size + history_size) / tracked,
+        "history_bytes_per_person": history_size / tracked,
+        "blocks_per_frame": float(np.median(blocks)),
+        "frame_us": float(np.mean(seconds) * 1e6),
+    }
+
+def main():
+    args = parse_args()
+    calibrations = load_calibrations(args.camera_file, args.cameras)
+    print(f"{'people':>8}{'bytes/person':>16}{'history':>12}{'blocks/frame':>16}{'frame us':>12}"
+          f"{'vs previous':>24}")
+    for people in [int(p) for p in args.people.split(",") if p]:
+        params = {"people": people, "cameras": args.cameras, "rate": args.rate,
+                  "messages": args.messages, "seed": args.seed}
+        results = bench_people(people, args, calibrations)
+        previous = load_previous(args.results, params)
+        change = ""
+        if previous:
+            old = previous["results"]
+            change = (f"{results['bytes_per_person'] / old['bytes_per_person'] - 1:+.0%} bytes, "
+                      f"{results['blocks_per_frame'] / max(old['blocks_per_frame'], 1) - 1:+.0%} blocks")
+        print(f"{people:>8}{results['bytes_per_person']:>16.0f}"
+              f"{results['history_bytes_per_person']:>12.0f}{results['blocks_per_frame']:>16.0f}"
+              f"{results['frame_us']:>12.0f}{change:>24}")
+        if not args.no_save:
+            os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+            with open(args.results, "a") as f:
+                f.write(json.dumps({
+                    "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "params": params,
+                    "results": results,
+                }) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Stand-in for scene_common.transform when benchmarking outside SceneScape.
+
+Only CameraPose.poseToPoseMat is provided, which is all detect_falls.py uses.
+Rotations are XYZ Euler angles in degrees or (x, y, z, w) quaternions.
+"""
+import sys
+import types
+
+import numpy as np
+
+def euler_xyz_to_matrix(angles_deg):
+    a, b, c = np.radians(angles_deg)
+    rx = np.array([[1, 0, 0], [0, np.cos(a), -np.sin(a)], [0, np.sin(a), np.cos(a)]])
+    ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    rz = np.array([[np.cos(c), -np.sin(c), 0], [np.sin(c), np.cos(c), 0], [0, 0, 1]])
+    return rx @ ry @ rz
+
+def quaternion_to_matrix(q):
+    x, y, z, w = np.asarray(q, dtype=float) / np.linalg.norm(q)
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+
+class CameraPose:
+    @staticmethod
+    def poseToPoseMat(translation, rotation, scale):
+        if len(rotation) == 4:
+            rot = quaternion_to_matrix(rotation)
+        else:
+            rot = euler_xyz_to_matrix(rotation)
+        pose_mat = np.eye(4)
+        pose_mat[:3, :3] = rot * np.asarray(scale, dtype=float)
+        pose_mat[:3, 3] = translation
+        return pose_mat
+
+def install():
+    """Registers this module as scene_common.transform unless the real one imports."""
+    try:
+        import scene_common.transform  # noqa: F401
+        return False
+    except ImportError:
+        pass
+    package = types.ModuleType("scene_common")
+    module = types.ModuleType("scene_common.transform")
+    module.CameraPose = CameraPose
+    package.transform = module
+    sys.modules["scene_common"] = package
+    sys.modules["scene_common.transform"] = module
+    return True
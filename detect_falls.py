@@ -1,24 +1,44 @@
 import argparse
+import copy
+import functools
+import heapq
+import itertools
 import os
 import json
-import requests
+import math
+import re
+import signal
 import sys
 import paho.mqtt.client as mqtt
 import ssl
+import struct
+import tempfile
+import threading
 import numpy as np
-from scene_common import transform
-from scipy.spatial.transform import Rotation as R
 import time
-from collections import defaultdict, deque
+# requests, scene_common.transform, multiprocessing and the modules behind
+# optional features (orjson, msgspec, scene_recorder, state_sink) are imported
+# where they are first needed, which keeps them off the startup path
+# (see benchmarks/bench_startup.py)
+import zlib
+from collections import OrderedDict, defaultdict, deque
+from typing import List, Optional, TypedDict
+from detector_metrics import MetricsRegistry, serve_metrics
+from sampling_profiler import SamplingProfiler
 
-def parse_args():
+# Scene message rate the default --history-capacity is sized for
+EXPECTED_SCENE_RATE = 30
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Fall Detection App")
     parser.add_argument('--controller-auth', type=str, default="/app/controller.auth",
                         help='Path to controller.auth JSON file')
     parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 1883)),
                         help='Port for both MQTT and API (default: 1883)')
-    parser.add_argument('--scene-uuid', type=str, required=True,
-                        help='Scene UUID to subscribe/query')
+    parser.add_argument('--scene-uuid', type=str, action='append', default=None,
+                        help='Scene UUID to subscribe/query (repeat to serve several scenes)')
+    parser.add_argument('--all-scenes', action='store_true',
+                        help='Serve every scene returned by the REST API')
     parser.add_argument('--insecure', action='store_true', default=True,
                         help='Run in insecure mode (ignore SSL certs)')
     parser.add_argument('--broker', type=str, required=True,
@@ -29,6 +49,13 @@ def parse_args():
                         help='Path to root CA certificate for MQTT TLS (Docker secret)')
     parser.add_argument('--window-seconds', type=float,
                         default=0.5, help='Rolling window size in seconds')
+    parser.add_argument('--history-capacity', type=int, default=None,
+                        help='Maximum samples kept per person and camera within the rolling window '
+                             f'(default: enough for --window-seconds at {EXPECTED_SCENE_RATE} Hz)')
+    parser.add_argument('--track-ttl', type=float, default=60.0,
+                        help='Seconds after which an unseen track and its history are dropped')
+    parser.add_argument('--max-tracks', type=int, default=10000,
+                        help='Maximum number of tracks kept in memory')
     parser.add_argument('--walk-velocity-threshold', type=float,
                         default=0.2, help='Velocity threshold for walking')
     parser.add_argument('--run-velocity-threshold', type=float,
@@ -37,9 +64,98 @@ def parse_args():
                         default=0.6, help='ARR threshold for fallen')
     parser.add_argument('--area-rate-threshold', type=float, default=5000.0,
                         help='Area rate threshold for fallen state logic')
-    return parser.parse_args()
+    parser.add_argument('--runtime', choices=['threads', 'asyncio'], default='threads',
+                        help='threads: paho-mqtt with worker threads; asyncio: aiomqtt event loop '
+                             'with concurrent startup (needs the aiomqtt package)')
+    parser.add_argument('--reconnect-delay', type=float, default=5.0,
+                        help='Seconds to wait before reconnecting to the broker (asyncio runtime)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processing threads fed from the MQTT thread (0 processes inline)')
+    parser.add_argument('--queue-scenes', type=int, default=1024,
+                        help='Maximum number of scenes with a frame waiting for a worker')
+    parser.add_argument('--shard-processes', type=int, default=0,
+                        help='Worker processes to shard people across by uuid (0 disables)')
+    parser.add_argument('--max-publish-rate', type=float, default=0.0,
+                        help='Maximum summaries published per second per scene (0 publishes every frame)')
+    parser.add_argument('--frame-budget-ms', type=float, default=0.0,
+                        help='Per-frame processing budget; over it, fast-moving people are processed '
+                             'less often than fall candidates (0 disables load shedding)')
+    parser.add_argument('--max-decimation', type=int, default=8,
+                        help='Under load shedding, process every person at least once every N frames')
+    parser.add_argument('--output-mode', choices=['full', 'delta'], default='full',
+                        help='Publish the full people list every frame, or keyframes plus deltas')
+    parser.add_argument('--keyframe-interval', type=float, default=5.0,
+                        help='Seconds between full keyframes in delta output mode')
+    parser.add_argument('--verbose-metrics', action='store_true',
+                        help='Include per-camera bounding boxes and feature vectors in the output')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus metrics on this port at /metrics (0 disables)')
+    parser.add_argument('--stats-interval', type=float, default=0.0,
+                        help='Seconds between stats messages on scenescape/fall-detection/<scene_id>/stats (0 disables)')
+    parser.add_argument('--json-backend', choices=['auto', 'orjson', 'json'], default='auto',
+                        help='JSON library for decoding scene messages and encoding results')
+    parser.add_argument('--selective-decode', action='store_true',
+                        help='Decode only the person fields used for fall detection (needs msgspec)')
+    parser.add_argument('--record-dir', type=str, default=None,
+                        help='Record raw scene messages to compressed segments in this directory')
+    parser.add_argument('--record-segment-mb', type=float, default=64.0,
+                        help='Size at which a recording segment is rotated (MB)')
+    parser.add_argument('--record-only', action='store_true',
+                        help='Only record scene messages, skip fall detection')
+    parser.add_argument('--state-db', type=str, default=None,
+                        help='Write per-person state transitions and state counts to this SQLite database')
+    parser.add_argument('--state-counts-interval', type=float, default=10.0,
+                        help='Seconds between state_counts rows per scene in --state-db')
+    parser.add_argument('--canonical-grid', action='store_true',
+                        help='Look canonical aspect ratios up in precomputed per-camera floor grids '
+                             'instead of projecting a box per person (requires --scene-map)')
+    parser.add_argument('--scene-map', default=None,
+                        help='Scene map PNG whose size gives the floor extent of the canonical grids')
+    parser.add_argument('--scene-map-ppm', type=float, default=None,
+                        help='Scene map pixels per meter (default: parsed from the file name, e.g. 73p76ppm)')
+    parser.add_argument('--canonical-grid-cell', type=float, default=0.1,
+                        help='Canonical grid spacing in meters')
+    parser.add_argument('--canonical-cache-size', type=int, default=0,
+                        help='Canonical boxes cached per camera, keyed by quantized pose (0 disables)')
+    parser.add_argument('--canonical-cache-cm', type=float, default=1.0,
+                        help='Quantization of translation and size for the canonical box cache, in cm')
+    parser.add_argument('--calibration-snapshot-dir', default='',
+                        help='Directory of per-scene calibration snapshots used to start without '
+                             'waiting for the REST API (default: disabled)')
+    parser.add_argument('--calibration-refresh', type=float, default=60.0,
+                        help='Seconds between re-polls of camera calibrations (0 disables hot reload)')
+    parser.add_argument('--tracker-snapshot-dir', default='',
+                        help='Directory of per-scene tracker state snapshots restored at startup '
+                             '(default: disabled)')
+    parser.add_argument('--tracker-snapshot-interval', type=float, default=5.0,
+                        help='Seconds between tracker state snapshots (0 disables)')
+    parser.add_argument('--tracker-snapshot-max-age', type=float, default=60.0,
+                        help='Oldest tracker snapshot restored at startup, in seconds '
+                             '(never less than --window-seconds)')
+    parser.add_argument('--profile-seconds', type=float, default=0.0,
+                        help='Profile the processing threads for this many seconds after startup (0 disables)')
+    parser.add_argument('--profile-signal-seconds', type=float, default=30.0,
+                        help='Length of the profile captured on SIGUSR1')
+    parser.add_argument('--profile-dir',
+                        default=os.path.join(tempfile.gettempdir(), 'fall-detection-profiles'),
+                        help='Directory for collapsed-stack profile files; keep it out of the '
+                             'bind-mounted /app checkout (default: %(default)s)')
+    parser.add_argument('--profile-interval-ms', type=float, default=5.0,
+                        help='Stack sampling interval while profiling')
+    args = parser.parse_args(argv)
+    if args.canonical_grid and not args.scene_map:
+        parser.error("--canonical-grid requires --scene-map")
+    if not args.scene_uuid and not args.all_scenes:
+        parser.error("one of --scene-uuid or --all-scenes is required")
+    if args.history_capacity is None:
+        args.history_capacity = default_history_capacity(args.window_seconds)
+    return args
 
-def get_cameras(api_url, api_key, insecure, retries=5, delay=5):
+def default_history_capacity(window_seconds):
+    return max(2, math.ceil(window_seconds * EXPECTED_SCENE_RATE) + 1)
+
+def fetch_json(api_url, api_key, insecure, what, retries=5, delay=5):
+    import requests
     headers = {"Authorization": f"Token {api_key}"}
     for attempt in range(1, retries + 1):
         try:
@@ -50,62 +166,402 @@ def get_cameras(api_url, api_key, insecure, retries=5, delay=5):
                 timeout=10
             )
             response.raise_for_status()
-            cameras = response.json()
-            if isinstance(cameras, dict) and "results" in cameras:
-                camera_count = len(cameras["results"])
-            elif isinstance(cameras, list):
-                camera_count = len(cameras)
-            else:
-                camera_count = 0
-            print(f"Retrieved {camera_count} cameras from API.")
-            return cameras
+            return response.json()
         except requests.RequestException as e:
-            print(
-                f"Error retrieving cameras from API (attempt {attempt}/{retries}): {e}", file=sys.stderr)
+            log_fetch_failure(what, attempt, retries, delay, e)
             if attempt < retries:
-                print(f"Retrying in {delay} seconds...")
                 time.sleep(delay)
-            else:
-                print("Max retries reached. Giving up.", file=sys.stderr)
     return None
 
-def project_point(pt3d, intrinsics, distortion):
-    fx, fy, cx, cy = intrinsics["fx"], intrinsics["fy"], intrinsics["cx"], intrinsics["cy"]
-    x, y, z = pt3d
-    if z == 0:
-        z = 1e-6
-    u = fx * x / z + cx
-    v = fy * y / z + cy
-    return [u, v]
-
-def get_canonical_bbox(obj, intrinsics, distortion, cam_extrinsics):
-    cx, cy, cz = obj["translation"]
-    w, d, h = obj["size"]
-    r = (w + d) / 8
-    h = h * 0.85
-    base_z = cz
-    top_z = cz + h
-    offsets = [(-r, -r), (-r, r), (r, -r), (r, r)]
-    corners_3d_world = []
-    for ox, oy in offsets:
-        corners_3d_world.append([cx + ox, cy + oy, base_z])
-        corners_3d_world.append([cx + ox, cy + oy, top_z])
-    corners_3d_cam = [world_to_camera(pt, cam_extrinsics)
-                      for pt in corners_3d_world]
-    filtered_corners_2d = []
-    for pt in corners_3d_cam:
-        if pt[2] <= 1e-3:
-            continue
-        filtered_corners_2d.append(project_point(pt, intrinsics, distortion))
-    if not filtered_corners_2d:
-        print("No valid projected 2D corners for canonical bbox (all points behind camera or invalid).")
+def log_fetch_failure(what, attempt, retries, delay, error):
+    print(
+        f"Error retrieving {what} from API (attempt {attempt}/{retries}): {error}", file=sys.stderr)
+    if attempt < retries:
+        print(f"Retrying in {delay} seconds...")
+    else:
+        print("Max retries reached. Giving up.", file=sys.stderr)
+
+def get_cameras(api_url, api_key, insecure, retries=5, delay=5):
+    cameras = fetch_json(api_url, api_key, insecure, "cameras", retries, delay)
+    if cameras is None:
         return None
-    xs = [pt[0] for pt in filtered_corners_2d]
-    ys = [pt[1] for pt in filtered_corners_2d]
-    x_min, x_max = min(xs), max(xs)
-    y_min, y_max = min(ys), max(ys)
-    bbox = {"x_min": x_min, "y_min": y_min, "x_max": x_max, "y_max": y_max}
-    return bbox
+    if isinstance(cameras, dict) and "results" in cameras:
+        camera_count = len(cameras["results"])
+    elif isinstance(cameras, list):
+        camera_count = len(cameras)
+    else:
+        camera_count = 0
+    print(f"Retrieved {camera_count} cameras from API.")
+    return cameras
+
+def get_scene_ids(api_url, api_key, insecure, retries=5, delay=5):
+    """Returns the uids of all scenes, following REST API pagination."""
+    scene_ids = []
+    while api_url:
+        scenes = fetch_json(api_url, api_key, insecure, "scenes", retries, delay)
+        if scenes is None:
+            return None
+        page_ids, api_url = parse_scene_page(scenes)
+        scene_ids.extend(page_ids)
+    print(f"Retrieved {len(scene_ids)} scenes from API.")
+    return scene_ids
+
+def parse_scene_page(scenes):
+    """Returns (scene uids, URL of the next page or None) of a /scenes response."""
+    if isinstance(scenes, dict):
+        results = scenes.get("results", [])
+        next_url = scenes.get("next")
+    else:
+        results = scenes
+        next_url = None
+    return [scene["uid"] for scene in results if scene.get("uid")], next_url
+
+def build_camera_calibrations(cameras):
+    camera_calibrations = {}
+    if isinstance(cameras, dict) and "results" in cameras:
+        camera_list = cameras["results"]
+    else:
+        camera_list = cameras
+
+    for cam in camera_list:
+        name = cam.get('name', cam.get('uid', 'unknown'))
+        intrinsics = cam.get("intrinsics") or {}
+        cx = intrinsics.get("cx")
+        cy = intrinsics.get("cy")
+        resolution = [2 * cx, 2 * cy] if cx and cy else cam.get("resolution")
+        camera_calibrations[name] = {
+            "extrinsics": {
+                "translation": cam.get("translation"),
+                "rotation": cam.get("rotation"),
+                "scale": cam.get("scale"),
+            },
+            "intrinsics": intrinsics,
+            "distortion": cam.get("distortion"),
+            "resolution": resolution,
+        }
+    return camera_calibrations
+
+def project_points(pts_cam, intrinsics_matrix):
+    z = pts_cam[:, 2]
+    z = np.where(z == 0, 1e-6, z)
+    uvw = pts_cam @ intrinsics_matrix.T
+    return np.stack([uvw[:, 0] / z, uvw[:, 1] / z], axis=1)
+
+# Unit offsets of the 8 canonical box corners: (x, y, base=0/top=1)
+CANONICAL_CORNER_OFFSETS = np.array([
+    [-1, -1, 0], [-1, -1, 1], [-1, 1, 0], [-1, 1, 1],
+    [1, -1, 0], [1, -1, 1], [1, 1, 0], [1, 1, 1],
+], dtype=float)
+
+def canonical_corners(translation, size):
+    """Returns (N, 8, 3) world corners of the canonical standing box per person."""
+    translation = np.asarray(translation, dtype=float).reshape(-1, 3)
+    size = np.asarray(size, dtype=float).reshape(-1, 3)
+    r = (size[:, 0] + size[:, 1]) / 8
+    h = size[:, 2] * 0.85
+    extent = np.stack([r, r, h], axis=1)
+    return translation[:, None, :] + CANONICAL_CORNER_OFFSETS[None, :, :] * extent[:, None, :]
+
+def project_canonical_bboxes(translation, size, camera):
+    """Returns (N, 4) canonical xyxy boxes, NaN rows where every corner is behind the camera."""
+    corners = canonical_corners(translation, size)
+    n = len(corners)
+    corners_3d_cam = world_to_camera(corners.reshape(-1, 3), camera.world_to_cam)
+    corners_2d = project_points(corners_3d_cam, camera.intrinsics_matrix).reshape(n, 8, 2)
+    valid = (corners_3d_cam[:, 2] > 1e-3).reshape(n, 8, 1)
+    with np.errstate(invalid="ignore"):
+        mins = np.where(valid, corners_2d, np.inf).min(axis=1)
+        maxs = np.where(valid, corners_2d, -np.inf).max(axis=1)
+    bboxes = np.concatenate([mins, maxs], axis=1)
+    bboxes[~valid.any(axis=1)[:, 0]] = np.nan
+    return bboxes
+
+# Person size (x, y, z in meters) the canonical grid is sampled for
+REFERENCE_PERSON_SIZE = (0.5, 0.5, 1.8)
+
+def canonical_box_dimensions(translation, size, camera):
+    """Returns (N, 2) projected canonical box width and height, NaN where any corner is behind the camera."""
+    corners = canonical_corners(translation, size)
+    corners_3d_cam = world_to_camera(corners.reshape(-1, 3), camera.world_to_cam)
+    corners_2d = project_points(corners_3d_cam, camera.intrinsics_matrix).reshape(-1, 8, 2)
+    dims = corners_2d.max(axis=1) - corners_2d.min(axis=1)
+    dims[~(corners_3d_cam[:, 2] > 1e-3).reshape(-1, 8).all(axis=1)] = np.nan
+    return dims, corners_2d.mean(axis=1)
+
+class CanonicalGrid:
+    """Canonical bbox aspect ratio and area over the scene floor for one camera.
+
+    Each grid node holds the log aspect ratio and log area of the canonical
+    box for REFERENCE_PERSON_SIZE standing there, plus their sensitivities to
+    log height and log width (x + y), which lookup() uses to correct for the
+    person's actual size. Nodes whose box is partly behind the camera or
+    centred off the image hold NaN; interpolation is bilinear, so a person
+    next to any such node gets NaN too. Node values are stored per cell as
+    bilinear coefficients, so a lookup is one gather and a few products.
+    """
+    __slots__ = ("origin", "cell", "shape", "coefficients")
+
+    SIZE_STEP = 1.1
+
+    def __init__(self, camera, resolution, extent, cell):
+        (x0, y0), (x1, y1) = extent
+        xs = x0 + cell * np.arange(int(np.ceil((x1 - x0) / cell)) + 1)
+        ys = y0 + cell * np.arange(int(np.ceil((y1 - y0) / cell)) + 1)
+        gx, gy = np.meshgrid(xs, ys, indexing="ij")
+        translation = np.stack([gx.ravel(), gy.ravel(), np.zeros(gx.size)], axis=1)
+        reference = np.tile(REFERENCE_PERSON_SIZE, (gx.size, 1))
+        taller = reference * [1, 1, self.SIZE_STEP]
+        wider = reference * [self.SIZE_STEP, self.SIZE_STEP, 1]
+        logs = []
+        for size in (reference, taller, wider):
+            dims, center = canonical_box_dimensions(translation, size, camera)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                width, height = np.log(dims).T
+            logs.append(np.stack([height - width, height + width], axis=1))
+        step = np.log(self.SIZE_STEP)
+        values = np.concatenate(
+            [logs[0], (logs[1] - logs[0]) / step, (logs[2] - logs[0]) / step], axis=1)
+        valid = np.isfinite(values).all(axis=1)
+        if resolution:
+            dims, center = canonical_box_dimensions(translation, reference, camera)
+            valid &= ((center >= 0) & (center <= np.asarray(resolution, dtype=float))).all(axis=1)
+        values[~valid] = np.nan
+        # Channels: log aspect, log area, their d/dlog(height), their d/dlog(width)
+        values = values.reshape(gx.shape + (6,))
+        v00, v10 = values[:-1, :-1], values[1:, :-1]
+        v01, v11 = values[:-1, 1:], values[1:, 1:]
+        coefficients = np.stack([v00, v10 - v00, v01 - v00, v11 - v10 - v01 + v00], axis=2)
+        # One extra all-NaN cell that positions off the grid are pointed at
+        self.coefficients = np.concatenate(
+            [coefficients.reshape(-1, 4, 6), np.full((1, 4, 6), np.nan)])
+        self.shape = (gx.shape[0] - 1, gx.shape[1] - 1)
+        self.origin = np.array([x0, y0])
+        self.cell = cell
+
+    def lookup(self, translation, size):
+        """Returns (aspect_ratio, area) per person, NaN outside the valid region."""
+        nx, ny = self.shape
+        pos = (translation[:, :2] - self.origin) / self.cell
+        index = pos.astype(np.intp)
+        inside = (pos[:, 0] >= 0) & (pos[:, 1] >= 0) & (index[:, 0] < nx) & (index[:, 1] < ny)
+        c = self.coefficients[np.where(inside, index[:, 0] * ny + index[:, 1], nx * ny)]
+        frac = pos - index
+        fx, fy = frac[:, :1], frac[:, 1:]
+        interpolated = c[:, 0] + c[:, 1] * fx + (c[:, 2] + c[:, 3] * fx) * fy
+        reference = REFERENCE_PERSON_SIZE
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_height = np.log(size[:, 2:3] / reference[2])
+            log_width = np.log((size[:, 0:1] + size[:, 1:2]) / (reference[0] + reference[1]))
+            logs = interpolated[:, 0:2] + interpolated[:, 2:4] * log_height + interpolated[:, 4:6] * log_width
+        logs[~np.isfinite(logs)] = np.nan
+        aspect_ratio, area = np.exp(logs).T
+        return aspect_ratio, area
+
+def scene_map_extent(path, pixels_per_meter=None):
+    """Returns the ((x0, y0), (x1, y1)) floor extent in meters covered by a PNG scene map.
+
+    The pixels per meter default to the value in the file name (e.g. 73p76ppm).
+    """
+    if pixels_per_meter is None:
+        match = re.search(r'(\d+)p(\d+)ppm', os.path.basename(path))
+        if not match:
+            raise ValueError(f"cannot parse pixels per meter from {path}, pass --scene-map-ppm")
+        pixels_per_meter = float(f"{match.group(1)}.{match.group(2)}")
+    with open(path, "rb") as f:
+        header = f.read(24)
+    if header[:8] != b"\x89PNG\r\n\x1a\n" or header[12:16] != b"IHDR":
+        raise ValueError(f"{path} is not a PNG image")
+    width, height = struct.unpack(">II", header[16:24])
+    return (0.0, 0.0), (width / pixels_per_meter, height / pixels_per_meter)
+
+def canonical_grid_spec(args):
+    """Returns the (extent, cell) canonical grids are built with, None when disabled."""
+    if not args.canonical_grid:
+        return None
+    return scene_map_extent(args.scene_map, args.scene_map_ppm), args.canonical_grid_cell
+
+class CanonicalBoxCache:
+    """Bounded LRU of one camera's canonical boxes keyed by quantized pose.
+
+    Translation and size are rounded to multiples of `quantum` meters and the
+    box is projected for the rounded pose, so a cached box does not depend on
+    which observation filled it. A cache belongs to one CameraProjection and
+    is dropped with it when the camera's calibration changes.
+    """
+    __slots__ = ("quantum", "max_entries", "entries")
+
+    def __init__(self, max_entries, quantum):
+        self.quantum = quantum
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def project(self, translation, size, camera, counters=None):
+        """Cached project_canonical_bboxes(); adds hit and miss counts to counters."""
+        keys = np.rint(np.hstack([translation, size]) / self.quantum).astype(np.int64)
+        bboxes = np.empty((len(keys), 4))
+        entries = self.entries
+        missing, missing_keys = [], []
+        for i, key in enumerate(map(tuple, keys.tolist())):
+            bbox = entries.get(key)
+            if bbox is None:
+                missing.append(i)
+                missing_keys.append(key)
+            else:
+                entries.move_to_end(key)
+                bboxes[i] = bbox
+        if missing:
+            pose = keys[missing] * self.quantum
+            projected = project_canonical_bboxes(pose[:, :3], pose[:, 3:], camera)
+            bboxes[missing] = projected
+            for key, bbox in zip(missing_keys, projected.tolist()):
+                entries[key] = bbox
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        if counters is not None:
+            counters["canonical_cache_hits"] = counters.get("canonical_cache_hits", 0) + len(keys) - len(missing)
+            counters["canonical_cache_misses"] = counters.get("canonical_cache_misses", 0) + len(missing)
+        return bboxes
+
+def projection_options(args):
+    """Returns the CalibrationCache keyword arguments selected on the command line."""
+    bbox_cache_spec = None
+    if args.canonical_cache_size > 0:
+        bbox_cache_spec = (args.canonical_cache_size, args.canonical_cache_cm / 100.0)
+    return {"grid_spec": canonical_grid_spec(args), "bbox_cache_spec": bbox_cache_spec}
+
+class CameraProjection:
+    """Projection data derived from a single camera calibration."""
+    __slots__ = ("world_to_cam", "intrinsics_matrix", "grid", "bbox_cache")
+
+    def __init__(self, calibration):
+        from scene_common import transform
+        extrinsics = calibration["extrinsics"]
+        intrinsics = calibration["intrinsics"]
+        t = np.array(extrinsics["translation"])
+        q = extrinsics["rotation"]
+        pose_mat = transform.CameraPose.poseToPoseMat(t, q, [1, 1, 1])
+        self.world_to_cam = np.linalg.inv(pose_mat)
+        self.intrinsics_matrix = np.array([
+            [intrinsics["fx"], 0.0, intrinsics["cx"]],
+            [0.0, intrinsics["fy"], intrinsics["cy"]],
+            [0.0, 0.0, 1.0],
+        ])
+        self.grid = None
+        self.bbox_cache = None
+
+    @classmethod
+    def from_matrices(cls, world_to_cam, intrinsics_matrix):
+        camera = cls.__new__(cls)
+        camera.world_to_cam = np.array(world_to_cam, dtype=float)
+        camera.intrinsics_matrix = np.array(intrinsics_matrix, dtype=float)
+        camera.grid = None
+        camera.bbox_cache = None
+        return camera
+
+class CalibrationCache:
+    """Per-camera projection matrices, rebuilt only when a calibration changes.
+
+    With a grid_spec, every camera also gets a CanonicalGrid, and with a
+    bbox_cache_spec a CanonicalBoxCache; both are rebuilt along with its
+    projection.
+    """
+
+    def __init__(self, camera_calibrations=None, grid_spec=None, bbox_cache_spec=None):
+        self.calibrations = {}
+        self.cameras = {}
+        self.grid_spec = grid_spec
+        self.bbox_cache_spec = bbox_cache_spec
+        if camera_calibrations:
+            self.update(camera_calibrations)
+
+    def update(self, camera_calibrations):
+        """Returns the ids of cameras that were added, changed or removed."""
+        changed = set(self.calibrations) - set(camera_calibrations)
+        cameras = {}
+        for cam_id, calib in camera_calibrations.items():
+            if cam_id in self.calibrations and self.calibrations[cam_id] == calib:
+                if cam_id in self.cameras:
+                    cameras[cam_id] = self.cameras[cam_id]
+                continue
+            changed.add(cam_id)
+            if calib.get("intrinsics") and calib.get("distortion") and calib.get("extrinsics"):
+                cameras[cam_id] = CameraProjection(calib)
+                self.attach_lookups(cameras[cam_id], calib)
+        self.calibrations = copy.deepcopy(camera_calibrations)
+        self.cameras = cameras
+        return changed
+
+    def get(self, cam_id):
+        return self.cameras.get(cam_id)
+
+    def attach_lookups(self, camera, calib):
+        if self.grid_spec is not None:
+            camera.grid = CanonicalGrid(camera, calib.get("resolution"), *self.grid_spec)
+        if self.bbox_cache_spec is not None:
+            camera.bbox_cache = CanonicalBoxCache(*self.bbox_cache_spec)
+
+    def to_snapshot(self):
+        return {
+            "calibrations": self.calibrations,
+            "projections": {
+                cam_id: {
+                    "world_to_cam": camera.world_to_cam.tolist(),
+                    "intrinsics_matrix": camera.intrinsics_matrix.tolist(),
+                }
+                for cam_id, camera in self.cameras.items()
+            },
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot, **options):
+        """Restores a cache without recomputing any projection matrices."""
+        cache = cls(**options)
+        cache.calibrations = snapshot["calibrations"]
+        cache.cameras = {
+            cam_id: CameraProjection.from_matrices(p["world_to_cam"], p["intrinsics_matrix"])
+            for cam_id, p in snapshot["projections"].items()
+        }
+        for cam_id, camera in cache.cameras.items():
+            cache.attach_lookups(camera, cache.calibrations.get(cam_id, {}))
+        return cache
+
+def calibration_snapshot_path(directory, scene_id):
+    return os.path.join(directory, f"{scene_id}.json")
+
+def save_calibration_snapshot(directory, scene):
+    """Atomically writes the scene's calibrations and derived matrices."""
+    os.makedirs(directory, exist_ok=True)
+    path = calibration_snapshot_path(directory, scene.scene_id)
+    snapshot = scene.calibration_cache.to_snapshot()
+    snapshot["scene_id"] = scene.scene_id
+    snapshot["saved_at"] = time.time()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+def load_calibration_snapshot(directory, scene_id, **options):
+    """Returns the scene's snapshotted CalibrationCache, or None."""
+    path = calibration_snapshot_path(directory, scene_id)
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+        cache = CalibrationCache.from_snapshot(snapshot, **options)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable calibration snapshot {path}: {e}", file=sys.stderr)
+        return None
+    age = time.time() - snapshot.get("saved_at", 0)
+    print(f"Loaded calibrations for scene {scene_id} from snapshot ({age:.0f}s old, "
+          f"{len(cache.cameras)} cameras)")
+    return cache
+
+def list_calibration_snapshots(directory):
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len(".json")] for name in os.listdir(directory)
+                  if name.endswith(".json"))
 
 def on_connect(client, userdata, flags, reason_code, properties):
     print(f"on_connect called with reason_code={reason_code}")
@@ -114,244 +570,1657 @@ def on_connect(client, userdata, flags, reason_code, properties):
         topic = userdata['mqtt_topic']
         print(f"Subscribing to topic: {topic}")
         client.subscribe(topic)
+        keyframe_topic = userdata.get('keyframe_topic')
+        if keyframe_topic:
+            print(f"Subscribing to topic: {keyframe_topic}")
+            client.subscribe(keyframe_topic)
     else:
         print(f"Failed to connect to MQTT broker, reason code {reason_code}")
 
-# {uuid: {cam_id: deque of (timestamp, feature_vector)}}
-feature_history = defaultdict(lambda: defaultdict(deque))
-tracked_people = {}
-# {uuid: {cam_id: deque of (timestamp, area)}}
-bb_area_history = defaultdict(lambda: defaultdict(deque))
-
-def compute_smoothed_area_and_rate(area_hist):
-    if area_hist:
-        times = np.array([t for t, _ in area_hist])
-        areas = np.array([a for _, a in area_hist])
-        if len(times) > 1:
-            weights = np.linspace(1, 2, len(times))
-        else:
-            weights = np.array([1.0])
-        weights /= weights.sum()
-        smoothed_area = float(np.average(areas, weights=weights))
-        if len(times) > 1:
-            slope, _ = np.polyfit(times, areas, 1)
-            area_rate = float(slope)
+FEATURE_WIDTH = 8
+# Columns of HistoryStore.values: the raw bbox area, then the feature vector
+AREA_COLUMN = 0
+FEATURE_COLUMNS = slice(1, 1 + FEATURE_WIDTH)
+# Appends after which a slot's running sums are recomputed from its ring
+HISTORY_REBUILD_INTERVAL = 1024
+
+class HistoryStore:
+    """Rolling windows of every (uuid, camera) in a scene as struct-of-arrays ring buffers.
+
+    Each (uuid, camera) owns a slot: times[slot] and values[slot] form a ring
+    of `capacity` samples, count[slot] long with the oldest at start[slot].
+    The area and feature windows share their sample times, so one ring holds
+    both (see AREA_COLUMN and FEATURE_COLUMNS). Every slot also keeps running
+    sums of its window that are added to as samples arrive and subtracted
+    from as they leave, so the weighted mean and the slope cost O(1) per
+    sample whatever the window length. All of it runs as numpy operations
+    over a frame's slots at once; the only per-observation Python left is
+    the slot lookup in slots().
+
+    Times in the sums are relative to a per-slot origin, and the sums are
+    recomputed from the ring every HISTORY_REBUILD_INTERVAL appends and
+    reset whenever a window empties, so rounding errors cannot build up.
+    A full ring drops its oldest sample; when that sample is still inside
+    the window the drop is counted in `overflows` and reported once.
+
+    The arrays double when every slot is taken and are halved again once
+    fewer than a quarter of the slots are in use.
+    """
+
+    _SLOT_ARRAYS = ("times", "values", "start", "count", "appended", "origin",
+                    "sum_v", "sum_kv", "sum_t", "sum_tt", "sum_tv")
+
+    def __init__(self, capacity, width=1 + FEATURE_WIDTH, slots=64):
+        self.capacity = capacity
+        self.initial_slots = slots
+        self.overflows = 0
+        self.times = np.zeros((slots, capacity))
+        self.values = np.zeros((slots, capacity, width))
+        self.start = np.zeros(slots, dtype=np.intp)
+        self.count = np.zeros(slots, dtype=np.intp)
+        self.appended = np.zeros(slots, dtype=np.intp)
+        self.origin = np.zeros(slots)
+        # Sums over each window of v, k * v with k the position from the
+        # oldest sample, t, t * t and t * v with t relative to origin
+        self.sum_v = np.zeros((slots, width))
+        self.sum_kv = np.zeros((slots, width))
+        self.sum_t = np.zeros(slots)
+        self.sum_tt = np.zeros(slots)
+        self.sum_tv = np.zeros((slots, width))
+        # {(uuid, cam_id): slot}, its inverse, and {uuid: [cam_id]} to release a person's slots
+        self.slot_ids = {}
+        self.slot_keys = [None] * slots
+        self.uuid_cameras = defaultdict(list)
+        self.free = list(range(slots - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.slot_ids)
+
+    def _grow(self):
+        slots = len(self.start)
+        for name in self._SLOT_ARRAYS:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        self.slot_keys.extend([None] * slots)
+        self.free.extend(range(2 * slots - 1, slots - 1, -1))
+
+    def _shrink(self):
+        """Moves the slots in use to the front and halves the arrays."""
+        slots = len(self.start) // 2
+        used = sorted(self.slot_ids.values())
+        for name in self._SLOT_ARRAYS:
+            array = getattr(self, name)
+            shrunk = np.zeros((slots,) + array.shape[1:], dtype=array.dtype)
+            shrunk[:len(used)] = array[used]
+            setattr(self, name, shrunk)
+        self.slot_keys = [self.slot_keys[slot] for slot in used] + [None] * (slots - len(used))
+        self.slot_ids = {key: i for i, key in enumerate(self.slot_keys[:len(used)])}
+        self.free = list(range(slots - 1, len(used) - 1, -1))
+
+    def _allocate(self, uuid, cam_id):
+        slot = self.slot_ids.get((uuid, cam_id))
+        if slot is None:
+            if not self.free:
+                self._grow()
+            slot = self.slot_ids[(uuid, cam_id)] = self.free.pop()
+            self.slot_keys[slot] = (uuid, cam_id)
+            self.uuid_cameras[uuid].append(cam_id)
+            self.start[slot] = 0
+            self.count[slot] = 0
+            self._reset([slot], 0.0)
+        return slot
+
+    def _reset(self, slots, origin):
+        """Zeroes the sums of empty slots and moves their time origin."""
+        self.appended[slots] = 0
+        self.origin[slots] = origin
+        self.sum_v[slots] = 0
+        self.sum_kv[slots] = 0
+        self.sum_t[slots] = 0
+        self.sum_tt[slots] = 0
+        self.sum_tv[slots] = 0
+
+    def _rebuild(self, slots):
+        """Recomputes the sums of non-empty slots from their rings, relative to the oldest sample."""
+        count = self.count[slots]
+        k = np.arange(count.max())
+        live = k < count[:, None]
+        rows = (self.start[slots, None] + k) % self.capacity
+        times = self.times[slots[:, None], rows]
+        t = np.where(live, times - times[:, :1], 0.0)
+        v = np.where(live[:, :, None], self.values[slots[:, None], rows], 0.0)
+        self.appended[slots] = 0
+        self.origin[slots] = times[:, 0]
+        self.sum_v[slots] = v.sum(axis=1)
+        self.sum_kv[slots] = np.einsum("k,rkc->rc", k, v)
+        self.sum_t[slots] = t.sum(axis=1)
+        self.sum_tt[slots] = (t * t).sum(axis=1)
+        self.sum_tv[slots] = np.einsum("rk,rkc->rc", t, v)
+
+    def _drop_oldest(self, slots):
+        position = self.start[slots]
+        t = self.times[slots, position] - self.origin[slots]
+        v = self.values[slots, position]
+        self.sum_v[slots] -= v
+        # The remaining samples each move one position closer to the oldest
+        self.sum_kv[slots] -= self.sum_v[slots]
+        self.sum_t[slots] -= t
+        self.sum_tt[slots] -= t * t
+        self.sum_tv[slots] -= t[:, None] * v
+        self.start[slots] = (position + 1) % self.capacity
+        self.count[slots] -= 1
+
+    def slots(self, uuids, cam_ids):
+        """Returns the slot of every (uuid, cam_id) pair, allocating slots for new ones."""
+        slot_ids = self.slot_ids
+        slots = [slot_ids.get(key) for key in zip(uuids, cam_ids)]
+        if None in slots:
+            slots = [self._allocate(uuid, cam_id) if slot is None else slot
+                     for slot, uuid, cam_id in zip(slots, uuids, cam_ids)]
+        return np.array(slots, dtype=np.intp)
+
+    def forget(self, uuid):
+        for cam_id in self.uuid_cameras.pop(uuid, ()):
+            slot = self.slot_ids.pop((uuid, cam_id))
+            self.slot_keys[slot] = None
+            self.count[slot] = 0
+            self.free.append(slot)
+        if len(self.start) > self.initial_slots and len(self.slot_ids) < len(self.start) // 4:
+            self._shrink()
+
+    def append(self, slots, now, window_seconds):
+        """Adds a sample at `now` to every slot and evicts samples older than the window.
+
+        slots must be distinct. Full rings drop their oldest sample. Returns
+        the ring position of each new sample; the caller must fill() every
+        column of it before the next append.
+        """
+        capacity = self.capacity
+        count = self.count[slots]
+        # A window whose newest sample has expired is emptied in one step
+        newest_time = self.times[slots, (self.start[slots] + count - 1) % capacity]
+        self.count[slots[(count > 0) & (now - newest_time > window_seconds)]] = 0
+        full = slots[self.count[slots] == capacity]
+        if len(full):
+            oldest = self.times[full, self.start[full]]
+            overflows = int(np.count_nonzero(now - oldest <= window_seconds))
+            if overflows and not self.overflows:
+                print(f"More than {capacity} samples fall within the {window_seconds:g}s "
+                      "rolling window; the oldest are dropped early. Raise --history-capacity.",
+                      file=sys.stderr)
+            self.overflows += overflows
+            self._drop_oldest(full)
+        # Drop the leading run of samples outside the window; in a steady
+        # stream each frame retires about one sample per slot, so this
+        # loop usually runs once or twice
+        while True:
+            live = slots[self.count[slots] > 0]
+            expired = live[now - self.times[live, self.start[live]] > window_seconds]
+            if not len(expired):
+                break
+            self._drop_oldest(expired)
+        empty = self.count[slots] == 0
+        if empty.any():
+            self._reset(slots[empty], now)
+        rebuild = slots[self.appended[slots] >= HISTORY_REBUILD_INTERVAL]
+        if len(rebuild):
+            self._rebuild(rebuild)
+
+        newest = (self.start[slots] + self.count[slots]) % capacity
+        self.times[slots, newest] = now
+        t = now - self.origin[slots]
+        self.sum_t[slots] += t
+        self.sum_tt[slots] += t * t
+        self.count[slots] += 1
+        self.appended[slots] += 1
+        return newest
+
+    def fill(self, slots, newest, columns, values):
+        """Sets columns of the samples append() returned and adds them to the sums.
+
+        values is (R, c) for a slice of columns, or (R,) for a single column.
+        """
+        if isinstance(columns, int):
+            columns = slice(columns, columns + 1)
+            values = values[:, None]
+        self.values[slots, newest, columns] = values
+        k = (self.count[slots] - 1)[:, None]
+        t = (self.times[slots, newest] - self.origin[slots])[:, None]
+        self.sum_v[slots, columns] += values
+        self.sum_kv[slots, columns] += k * values
+        self.sum_tv[slots, columns] += t * values
+
+    def weighted_mean(self, slots, columns):
+        """Mean of each window with np.linspace(1, 2, n) weights, newest heaviest.
+
+        Weight 1 + k / (n - 1) at position k sums to 1.5 n. Returns (R, c)
+        for a slice of columns, or (R,) for a single column.
+        """
+        n = self.count[slots].astype(float)
+        sum_v, sum_kv = self.sum_v[slots, columns], self.sum_kv[slots, columns]
+        if sum_v.ndim > 1:
+            n = n[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(n > 1, (sum_v + sum_kv / (n - 1)) / (1.5 * n), sum_v)
+
+    def slope(self, slots, column):
+        """Least-squares slope of a column against time over each window, 0 below 2 samples."""
+        n = self.count[slots]
+        sum_t, sum_tt = self.sum_t[slots], self.sum_tt[slots]
+        denom = n * sum_tt - sum_t * sum_t
+        # Samples with equal times (a person seen twice in a frame) leave
+        # only rounding error in denom
+        valid = (n > 1) & (denom > 1e-9 * n * sum_tt)
+        numer = n * self.sum_tv[slots, column] - sum_t * self.sum_v[slots, column]
+        return np.where(valid, numer / np.where(valid, denom, 1.0), 0.0)
+
+    def copy_windows(self, now, window_seconds):
+        """Copies the rings of the slots whose newest sample is inside the window.
+
+        Slots that the next append would empty are left out. Returns
+        (slot keys, times, values, start, count) for window_samples().
+        """
+        count = self.count
+        newest = self.times[np.arange(len(count)), (self.start + count - 1) % self.capacity]
+        used = np.flatnonzero((count > 0) & (now - newest <= window_seconds))
+        return ([self.slot_keys[slot] for slot in used.tolist()],
+                self.times[used], self.values[used], self.start[used], count[used])
+
+    def samples(self, uuid):
+        """Returns {cam_id: (times, values)} copies of a person's windows, oldest first."""
+        histories = {}
+        for cam_id in self.uuid_cameras.get(uuid, ()):
+            slot = self.slot_ids[(uuid, cam_id)]
+            rows = (self.start[slot] + np.arange(self.count[slot])) % self.capacity
+            histories[cam_id] = (self.times[slot, rows], self.values[slot, rows])
+        return histories
+
+    def load(self, uuid, cam_id, times, values):
+        """Fills a person's window for one camera from samples(), keeping the newest `capacity`."""
+        slot = self._allocate(uuid, cam_id)
+        times, values = times[-self.capacity:], values[-self.capacity:]
+        self.start[slot] = 0
+        self.count[slot] = len(times)
+        self.times[slot, :len(times)] = times
+        self.values[slot, :len(times)] = values
+        if len(times):
+            self._rebuild(np.array([slot]))
+
+def distinct_slot_passes(slots):
+    """Splits row indices into passes in which no slot repeats, keeping row order per slot."""
+    if not len(slots) or np.bincount(slots).max() == 1:
+        return [np.arange(len(slots))]
+    seen = defaultdict(int)
+    passes = defaultdict(list)
+    for i, slot in enumerate(slots.tolist()):
+        passes[seen[slot]].append(i)
+        seen[slot] += 1
+    return [np.array(rows) for rows in passes.values()]
+
+
+# Schema for selective decoding: only the fields on_message reads are
+# materialized, everything else in the scene message is skipped by msgspec.
+class BoundingBoxPx(TypedDict):
+    x: float
+    y: float
+    width: float
+    height: float
+
+class SceneObject(TypedDict, total=False):
+    id: str
+    category: str
+    velocity: Optional[List[float]]
+    translation: Optional[List[float]]
+    size: Optional[List[float]]
+    bounding_box_px: BoundingBoxPx
+    bounding_box_camera_id: str
+
+class SceneMessage(TypedDict, total=False):
+    timestamp: str
+    objects: List[SceneObject]
+
+class JsonCodec:
+    """Scene message decoding and summary encoding with a pluggable JSON library.
+
+    backend "auto" uses orjson when it is installed and the standard library
+    otherwise. With selective=True scene messages are decoded through msgspec
+    against SceneMessage, falling back to a full decode if msgspec is missing
+    or a message does not fit the schema.
+    """
+
+    def __init__(self, backend="auto", selective=False):
+        orjson = None
+        if backend in ("auto", "orjson"):
+            try:
+                import orjson
+            except ImportError:
+                if backend == "orjson":
+                    raise ValueError("orjson is not installed")
+        if orjson is not None:
+            backend = "orjson"
+            self.loads = orjson.loads
+            self.dumps = orjson.dumps
         else:
-            area_rate = 0.0
-    else:
-        smoothed_area = 0.0
-        area_rate = 0.0
-    return smoothed_area, area_rate
+            backend = "json"
+            self.loads = json.loads
+            self.dumps = json.dumps
+        self.backend = backend
+        self._scene_decoder = None
+        self._schema_error = None
+        if selective:
+            try:
+                import msgspec
+            except ImportError:
+                print("msgspec is not installed; selective decoding disabled.")
+            else:
+                self._scene_decoder = msgspec.json.Decoder(SceneMessage)
+                self._schema_error = msgspec.ValidationError
 
-def on_message(client, userdata, msg):
+    def decode_scene(self, payload):
+        if self._scene_decoder is not None:
+            try:
+                return self._scene_decoder.decode(payload)
+            except self._schema_error as e:
+                print(f"Scene message does not fit the selective schema ({e}); "
+                      "using full decoding from now on.")
+                self._scene_decoder = None
+        return self.loads(payload)
+
+class DeltaEncoder:
+    """Turns a scene's full summaries into keyframes and deltas.
+
+    Deltas list only people who appeared, changed state or left since the
+    previous message. Every message carries a sequence number; a subscriber
+    that sees a gap publishes to <output topic>/keyframe-request and the next
+    message is a keyframe. Keyframes are also sent every keyframe_interval.
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self.published_states = {}
+        self.last_keyframe = None
+        self.keyframe_requested = False
+
+    def encode(self, message, now, keyframe_interval):
+        self.seq += 1
+        people = {person["uuid"]: person for person in message["people"]}
+        previous = self.published_states
+        self.published_states = {uuid: person["state"] for uuid, person in people.items()}
+        if (self.keyframe_requested or self.last_keyframe is None
+                or now - self.last_keyframe >= keyframe_interval):
+            self.keyframe_requested = False
+            self.last_keyframe = now
+            return {"type": "keyframe", "seq": self.seq, **message}
+        return {
+            "type": "delta",
+            "seq": self.seq,
+            "timestamp": message["timestamp"],
+            "state_counts": message["state_counts"],
+            "scene_id": message["scene_id"],
+            "people_count": len(people),
+            "appeared": [p for uuid, p in people.items() if uuid not in previous],
+            "changed": [p for uuid, p in people.items()
+                        if uuid in previous and previous[uuid] != p["state"]],
+            "left": [uuid for uuid in previous if uuid not in people],
+        }
+
+class PublishFlusher:
+    """One long-lived thread that publishes coalesced summaries when they fall due.
+
+    PublishScheduler.submit() registers the time its pending summary may go
+    out; entries a scheduler has since published or replaced are skipped.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Heap of (due time, tie-breaker, scheduler)
+        self._due = []
+        self._order = itertools.count()
+        threading.Thread(target=self._run, name="publish-flusher", daemon=True).start()
+
+    def schedule(self, scheduler, due):
+        with self._condition:
+            heapq.heappush(self._due, (due, next(self._order), scheduler))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    wait = self._due[0][0] - time.time() if self._due else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                due, _, scheduler = heapq.heappop(self._due)
+            scheduler._flush(due)
+
+class PublishScheduler:
+    """Caps how often a scene's summary is published, keeping only the latest.
+
+    Every frame is still processed; publishing is limited to max_rate per
+    second and summaries arriving in between replace the pending one, which
+    the shared PublishFlusher publishes once the interval has passed. A
+    summary in which someone newly enters the fallen state is published
+    immediately so alert latency does not depend on the limit.
+    """
+
+    def __init__(self, max_rate, publish, flusher):
+        self.interval = 1.0 / max_rate
+        self.publish = publish
+        self.flusher = flusher
+        self.coalesced = 0
+        self.lock = threading.Lock()
+        self.pending = None
+        # When the pending summary is scheduled to go out, None if it is not
+        self.due = None
+        self.last_publish = float("-inf")
+        self.fallen = set()
+
+    def submit(self, message, now):
+        fallen = {person["uuid"] for person in message["people"] if person["state"] == "fallen"}
+        new_fall = not fallen <= self.fallen
+        self.fallen = fallen
+        with self.lock:
+            if new_fall or now - self.last_publish >= self.interval:
+                self.due = None
+                self.pending = None
+                self._publish(message, now)
+                return
+            if self.pending is not None:
+                self.coalesced += 1
+            self.pending = message
+            if self.due is None:
+                self.due = self.last_publish + self.interval
+                self.flusher.schedule(self, self.due)
+
+    def _flush(self, due):
+        with self.lock:
+            # A summary published or rescheduled since then makes this entry stale
+            if due != self.due:
+                return
+            self.due = None
+            if self.pending is not None:
+                message, self.pending = self.pending, None
+                self._publish(message, time.time())
+
+    def _publish(self, message, now):
+        self.last_publish = now
+        try:
+            self.publish(message)
+        except Exception as e:
+            print(f"Error publishing fall detection summary: {e}")
+
+class LoadShedder:
+    """Keeps a scene's frame processing within a time budget.
+
+    People who are fall candidates (last state fallen or falling, slower than
+    the walk threshold, or not tracked yet) are processed every frame. When
+    the rest do not fit in the budget at the measured cost per observation,
+    they are processed every `stride` frames, staggered by uuid, and carry
+    their last state and features forward in between.
+    """
+    SMOOTHING = 0.1
+
+    def __init__(self, budget_seconds, walk_velocity, max_stride):
+        self.budget = budget_seconds
+        self.walk_velocity = walk_velocity
+        self.max_stride = max(1, max_stride)
+        # Moving averages of the seconds per processed observation and per frame besides
+        self.row_cost = 0.0
+        self.overhead = 0.0
+        self.frame_index = 0
+        self.stride = 1
+
+    def select(self, frame, tracked_people):
+        """Returns (row indices to process or None for all, uuids to carry forward)."""
+        self.frame_index += 1
+        self.stride = 1
+        if self.row_cost <= 0:
+            return None, []
+        capacity = int(max(self.budget - self.overhead, 0.0) / self.row_cost)
+        if len(frame) <= capacity:
+            return None, []
+        rows_by_uuid = defaultdict(list)
+        for i, uuid in enumerate(frame.uuids):
+            rows_by_uuid[uuid].append(i)
+        slow = np.linalg.norm(frame.velocity, axis=1) < self.walk_velocity
+        rows, fast = [], []
+        for uuid, uuid_rows in rows_by_uuid.items():
+            prev = tracked_people.get(uuid)
+            if prev is None or prev.state <= STATE_INDEX["falling"] or slow[uuid_rows].any():
+                rows.extend(uuid_rows)
+            else:
+                fast.append(uuid)
+        spare = capacity - len(rows)
+        fast_rows = len(frame) - len(rows)
+        self.stride = min(self.max_stride, -(-fast_rows // spare) if spare > 0 else self.max_stride)
+        shed = []
+        for uuid in fast:
+            # crc32 gives every uuid a fixed turn, spreading the fast people over the stride
+            if (zlib.crc32(uuid.encode("utf-8")) + self.frame_index) % self.stride == 0:
+                rows.extend(rows_by_uuid[uuid])
+            else:
+                shed.append(uuid)
+        rows.sort()
+        return rows, shed
+
+    def observe(self, rows, person_seconds, total_seconds):
+        """Updates the cost model; returns True when the frame went over budget."""
+        if rows:
+            a = self.SMOOTHING if self.row_cost > 0 else 1.0
+            self.row_cost += a * (person_seconds / rows - self.row_cost)
+            self.overhead += a * (total_seconds - person_seconds - self.overhead)
+        return total_seconds > self.budget
+
+class SceneState:
+    """Calibrations and tracker state for one SceneScape scene."""
+
+    def __init__(self, scene_id, camera_calibrations, calibration_cache=None, **options):
+        self.scene_id = scene_id
+        self.publish_topic = f"scenescape/fall-detection/{scene_id}"
+        self.delta_encoder = DeltaEncoder()
+        self.publish_scheduler = None
+        self.load_shedder = None
+        self.calibration_cache = calibration_cache or CalibrationCache(camera_calibrations, **options)
+        self.camera_calibrations = self.calibration_cache.calibrations
+        # Area and feature windows per (uuid, camera), created on first use
+        self.history = None
+        # {uuid: Track}, kept in last-seen order (oldest first)
+        self.tracked_people = OrderedDict()
+
+    def update_calibrations(self, camera_calibrations):
+        """Swaps in new calibrations, rebuilding only the changed cameras.
+
+        The new cache is built beside the live one and published with a single
+        assignment, so a frame in flight sees either the old or the new set.
+        Returns the ids of the changed cameras.
+        """
+        cache = copy.copy(self.calibration_cache)
+        changed = cache.update(camera_calibrations)
+        if changed:
+            self.calibration_cache = cache
+            self.camera_calibrations = cache.calibrations
+        return changed
+
+    def expire_tracks(self, now, ttl_seconds, max_tracks):
+        """Evicts tracks not seen for ttl_seconds, then the oldest beyond max_tracks.
+
+        Only the evicted tracks are visited since tracked_people is in last-seen
+        order. Returns the evicted uuids.
+        """
+        expired = []
+        while self.tracked_people:
+            uuid, track = next(iter(self.tracked_people.items()))
+            if now - track.last_seen <= ttl_seconds and len(self.tracked_people) <= max_tracks:
+                break
+            self.tracked_people.popitem(last=False)
+            self.forget_history(uuid)
+            expired.append(uuid)
+        return expired
+
+    def history_store(self, capacity):
+        if self.history is None:
+            self.history = HistoryStore(capacity)
+        return self.history
+
+    def forget_history(self, uuid):
+        if self.history is not None:
+            self.history.forget(uuid)
+
+    def active_tracks(self, now, window_seconds):
+        """Tracks seen within the window, walking back from the most recent one.
+
+        Tracks that have just left the window drop their metrics, so people no
+        longer reported do not keep old frames' PersonMetrics alive.
+        """
+        active = []
+        tracks = reversed(self.tracked_people.values())
+        for track in tracks:
+            if now - track.last_seen >= window_seconds:
+                track.metrics = None
+                break
+            active.append(track)
+        # Older tracks left the window earlier and were released then
+        for track in tracks:
+            if track.metrics is None:
+                break
+            track.metrics = None
+        active.reverse()
+        return active
+
+# A tracker snapshot is TRACKER_HEADER (magic, version, save time) followed by
+# a zlib-compressed body: the camera id table, then one TRACKER_PERSON record
+# per track with its uuid and camera indices, and one TRACKER_HISTORY record
+# per camera followed by the area and feature samples as float64
+# (time, values...) rows, oldest first.
+TRACKER_MAGIC = b"FDTS"
+TRACKER_VERSION = 1
+TRACKER_HEADER = struct.Struct("<4sHd")
+TRACKER_PERSON = struct.Struct("<BddHBB")
+TRACKER_HISTORY = struct.Struct("<HHH")
+
+def tracker_snapshot_path(directory, scene_id):
+    return os.path.join(directory, f"{scene_id}.bin")
+
+def capture_tracker_state(scene, now, window_seconds):
+    """Copies what a tracker snapshot needs; cheap enough for the processing thread.
+
+    Returns (tracks, windows) for tracker_state_records(): tracks is
+    [(uuid, STATE_PRIORITY index, state_start_time, last_seen, camera_ids)]
+    in last-seen order and windows the HistoryStore.copy_windows() bulk copy
+    of the windows still holding samples, or None without a history store.
+    Windows that have already expired would be emptied on the first frame
+    after a restore, so they are not copied.
+    """
+    tracks = [(uuid, track.state, track.state_start_time, track.last_seen, track.camera_ids)
+              for uuid, track in scene.tracked_people.items()]
+    windows = scene.history.copy_windows(now, window_seconds) if scene.history is not None else None
+    return tracks, windows
+
+def tracker_state_records(tracks, windows):
+    """Joins capture_tracker_state() output into per-person snapshot records, off the hot path.
+
+    Returns [(uuid, STATE_PRIORITY index, state_start_time, last_seen,
+    camera_ids, {cam_id: (area samples, feature samples)})].
+    """
+    histories = defaultdict(dict)
+    if windows is not None:
+        keys, times, values, start, count = windows
+        if len(keys):
+            capacity = times.shape[1]
+            for i, (uuid, cam_id) in enumerate(keys):
+                rows = (start[i] + np.arange(count[i])) % capacity
+                histories[uuid][cam_id] = ((times[i, rows], values[i, rows, AREA_COLUMN:AREA_COLUMN + 1]),
+                                           (times[i, rows], values[i, rows, FEATURE_COLUMNS]))
+    return [(uuid, state, state_start_time, last_seen, list(camera_ids), histories.get(uuid, {}))
+            for uuid, state, state_start_time, last_seen, camera_ids in tracks]
+
+def encode_tracker_state(captured, saved_at):
+    cameras = {}
+    for person in captured:
+        for cam_id in person[4] + list(person[5]):
+            cameras.setdefault(cam_id, len(cameras))
+    body = bytearray(struct.pack("<H", len(cameras)))
+    for cam_id in cameras:
+        encoded = cam_id.encode("utf-8")
+        body += struct.pack("<H", len(encoded)) + encoded
+    body += struct.pack("<I", len(captured))
+    empty = (np.zeros(0), np.zeros((0, 0)))
+    for uuid, state, state_start_time, last_seen, camera_ids, histories in captured:
+        encoded = uuid.encode("utf-8")
+        body += TRACKER_PERSON.pack(state, state_start_time, last_seen, len(encoded),
+                                    len(camera_ids), len(histories))
+        body += encoded
+        body += struct.pack(f"<{len(camera_ids)}H", *(cameras[c] for c in camera_ids))
+        for cam_id, (area, features) in histories.items():
+            area, features = area or empty, features or empty
+            body += TRACKER_HISTORY.pack(cameras[cam_id], len(area[0]), len(features[0]))
+            for times, values in (area, features):
+                body += np.column_stack([times, values]).astype("<f8").tobytes()
+    return TRACKER_HEADER.pack(TRACKER_MAGIC, TRACKER_VERSION, saved_at) + zlib.compress(bytes(body), 6)
+
+def decode_tracker_state(data):
+    """Inverse of encode_tracker_state; returns (saved_at, captured)."""
+    magic, version, saved_at = TRACKER_HEADER.unpack_from(data)
+    if magic != TRACKER_MAGIC or version != TRACKER_VERSION:
+        raise ValueError(f"not a version {TRACKER_VERSION} tracker snapshot")
+    body = zlib.decompress(data[TRACKER_HEADER.size:])
+    pos = 0
+
+    def read(fmt):
+        nonlocal pos
+        values = struct.unpack_from(fmt, body, pos)
+        pos += struct.calcsize(fmt)
+        return values
+
+    def read_samples(count, width):
+        nonlocal pos
+        rows = np.frombuffer(body, "<f8", count * (width + 1), pos).reshape(count, width + 1)
+        pos += rows.nbytes
+        return rows[:, 0].copy(), rows[:, 1:].copy()
+
+    cameras = []
+    for _ in range(read("<H")[0]):
+        length, = read("<H")
+        cameras.append(body[pos:pos + length].decode("utf-8"))
+        pos += length
+    captured = []
+    for _ in range(read("<I")[0]):
+        state_index, state_start_time, last_seen, uuid_length, camera_count, history_count = \
+            read(TRACKER_PERSON.format)
+        uuid = body[pos:pos + uuid_length].decode("utf-8")
+        pos += uuid_length
+        camera_ids = [cameras[i] for i in read(f"<{camera_count}H")]
+        histories = {}
+        for _ in range(history_count):
+            cam_index, area_count, feature_count = read(TRACKER_HISTORY.format)
+            histories[cameras[cam_index]] = (read_samples(area_count, 1),
+                                             read_samples(feature_count, FEATURE_WIDTH))
+        captured.append((uuid, state_index, state_start_time, last_seen, camera_ids, histories))
+    return saved_at, captured
+
+def save_tracker_snapshot(directory, scene_id, captured, saved_at=None):
+    """Atomically writes a tracker snapshot of tracker_state_records() output."""
+    os.makedirs(directory, exist_ok=True)
+    path = tracker_snapshot_path(directory, scene_id)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_tracker_state(captured, time.time() if saved_at is None else saved_at))
+    os.replace(tmp_path, path)
+
+def load_tracker_snapshot(directory, scene_id, max_age):
+    """Returns (saved_at, captured) from a snapshot at most max_age seconds old, or None."""
+    path = tracker_snapshot_path(directory, scene_id)
     try:
-        payload = msg.payload.decode('utf-8')
-        data = json.loads(payload)
-        timestamp = data.get("timestamp")
+        with open(path, "rb") as f:
+            saved_at, captured = decode_tracker_state(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, IndexError, struct.error, zlib.error) as e:
+        print(f"Ignoring unreadable tracker snapshot {path}: {e}", file=sys.stderr)
+        return None
+    age = time.time() - saved_at
+    if age > max_age:
+        print(f"Ignoring tracker snapshot for scene {scene_id}: {age:.0f}s old, "
+              f"limit {max_age:g}s")
+        return None
+    return saved_at, captured
+
+def restore_tracker_state(scene, captured, history_capacity):
+    """Loads captured tracks and histories into an empty SceneState."""
+    for uuid, state, state_start_time, last_seen, camera_ids, histories in captured:
+        scene.tracked_people[uuid] = Track(
+            uuid, state, state_start_time, last_seen, tuple(intern_camera_id(c) for c in camera_ids))
+        for cam_id, (area, features) in histories.items():
+            # Both windows are written together, so their samples line up
+            count = min(len(area[0]), len(features[0]))
+            if count:
+                scene.history_store(history_capacity).load(
+                    uuid, cam_id, features[0][-count:],
+                    np.column_stack([area[1][-count:], features[1][-count:]]))
+
+def restore_tracker_snapshots(args, scenes):
+    """Restores each scene's tracker snapshot if it is recent enough."""
+    max_age = max(args.tracker_snapshot_max_age, args.window_seconds)
+    for scene in scenes.values():
+        loaded = load_tracker_snapshot(args.tracker_snapshot_dir, scene.scene_id, max_age)
+        if loaded is None:
+            continue
+        saved_at, captured = loaded
+        restore_tracker_state(scene, captured, args.history_capacity)
+        print(f"Restored {len(captured)} tracks for scene {scene.scene_id} from snapshot "
+              f"({time.time() - saved_at:.0f}s old)")
+
+class TrackerSnapshotter:
+    """Writes per-scene tracker snapshots every `interval` seconds.
+
+    The processing thread calls due() after each frame and, when it returns
+    True, hands capture_tracker_state() to submit(). Building the per-person
+    records, encoding, compression and the atomic write run on the snapshot
+    thread.
+    """
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.written = 0
+        self.failures = 0
+        self._last = {}
+        self._pending = {}
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, name="tracker-snapshots", daemon=True).start()
 
-        camera_calibrations = userdata.get("camera_calibrations", {})
-        args = userdata.get("args")
-        window_seconds = args.window_seconds if args else 2.0
+    def due(self, scene_id, now):
+        if now - self._last.get(scene_id, 0.0) < self.interval:
+            return False
+        self._last[scene_id] = now
+        return True
+
+    def submit(self, scene_id, captured, saved_at):
+        with self._condition:
+            # A newer capture replaces one the thread has not written yet
+            self._pending[scene_id] = (captured, saved_at)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                scene_id, (captured, saved_at) = self._pending.popitem()
+            try:
+                save_tracker_snapshot(self.directory, scene_id,
+                                      tracker_state_records(*captured), saved_at)
+                self.written += 1
+            except Exception as e:
+                self.failures += 1
+                print(f"Failed to write tracker snapshot for scene {scene_id}: {e}",
+                      file=sys.stderr)
+
+# Most severe first; the consensus state of a person is the lowest index seen
+STATE_PRIORITY = ["fallen", "falling", "running", "walking", "standing", "unknown"]
+STATE_INDEX = {state: i for i, state in enumerate(STATE_PRIORITY)}
+# Key order of the published state_counts
+STATE_COUNT_ORDER = ("fallen", "standing", "walking", "running", "falling", "unknown")
+
+# One shared string per camera id, however many tracks and frames refer to it
+CAMERA_IDS = {}
+
+def intern_camera_id(cam_id):
+    return CAMERA_IDS.setdefault(cam_id, cam_id)
+
+class PersonMetrics:
+    """Per-observation results of one processed frame (or shard of a frame).
+
+    Rows line up with the PersonFrame the metrics were computed from; rows
+    maps each uuid to its row indices. Tracks keep a reference to the
+    PersonMetrics of the frame they were last processed in, and the
+    per-camera output dicts are only built by to_json().
+    """
+    __slots__ = ("cam_ids", "bboxes_px", "canonical", "features", "smoothed", "states", "rows")
+
+    def __init__(self, cam_ids, bboxes_px, canonical, features, smoothed, states, rows):
+        self.cam_ids = cam_ids
+        self.bboxes_px = bboxes_px
+        self.canonical = canonical
+        self.features = features
+        self.smoothed = smoothed
+        self.states = states
+        self.rows = rows
+
+    def to_json(self, rows):
+        metrics = {}
+        for i in rows:
+            bb_canonical = None
+            if not np.isnan(self.canonical[i, 0]):
+                x_min, y_min, x_max, y_max = self.canonical[i].tolist()
+                bb_canonical = xyxy_to_xywh(
+                    {"x_min": x_min, "y_min": y_min, "x_max": x_max, "y_max": y_max})
+            metrics[self.cam_ids[i]] = {
+                "bounding_box_px": self.bboxes_px[i],
+                "bb_canonical": bb_canonical,
+                "feature_vector": self.features[i, :4].tolist() + [int(f) for f in self.features[i, 4:]],
+                "feature_vector_smoothed": self.smoothed[i].tolist(),
+                "state": STATE_PRIORITY[self.states[i]]
+            }
+        return metrics
 
-        # {uuid: [(feature_vector, cam_id)]}
-        person_features = defaultdict(list)
-        canonical_bboxes = {}
-        metrics_by_uuid = defaultdict(dict)
+class Track:
+    """A tracked person, updated in place each frame they are processed.
 
-        for obj in data.get("objects", []):
+    state is a STATE_PRIORITY index and camera_ids a tuple of interned ids;
+    the published dict is only built by to_json().
+    """
+    __slots__ = ("uuid", "state", "state_start_time", "last_seen", "camera_ids", "metrics", "rows")
+
+    def __init__(self, uuid, state, state_start_time, last_seen, camera_ids=()):
+        self.uuid = uuid
+        self.state = state
+        self.state_start_time = state_start_time
+        self.last_seen = last_seen
+        self.camera_ids = camera_ids
+        self.metrics = None
+        self.rows = ()
+
+    def to_json(self, verbose=False):
+        person = {
+            "uuid": self.uuid,
+            "state": STATE_PRIORITY[self.state],
+            "state_duration": self.last_seen - self.state_start_time,
+            "camera_ids": list(self.camera_ids)
+        }
+        if verbose:
+            person["metrics"] = self.metrics.to_json(self.rows) if self.metrics is not None else {}
+        return person
+
+class PersonFrame:
+    """Columnar view of the person observations in one scene message.
+
+    Row i is one (person, camera) observation: a person object that carries a
+    detected bounding box from camera cam_ids[i].
+    """
+    __slots__ = ("uuids", "cam_ids", "bboxes_px", "velocity", "translation", "size", "bbox")
+
+    def __init__(self, uuids, cam_ids, bboxes_px, velocity, translation, size, bbox):
+        self.uuids = uuids
+        self.cam_ids = cam_ids
+        self.bboxes_px = bboxes_px
+        self.velocity = velocity
+        self.translation = translation
+        self.size = size
+        self.bbox = bbox
+
+    @classmethod
+    def from_objects(cls, objects):
+        uuids, cam_ids, bboxes_px = [], [], []
+        velocity, translation, size, bbox = [], [], [], []
+        for obj in objects:
             uuid = obj.get("id")
             if not uuid or obj.get("category") != "person":
                 continue
+            if "bounding_box_px" not in obj or "bounding_box_camera_id" not in obj:
+                continue
+            detected_bbox = obj["bounding_box_px"]
+            uuids.append(uuid)
+            cam_ids.append(intern_camera_id(obj["bounding_box_camera_id"]))
+            bboxes_px.append(detected_bbox)
+            velocity.append(obj.get("velocity") or (0, 0, 0))
+            translation.append(obj.get("translation") or (0, 0, 0))
+            size.append(obj.get("size") or (0, 0, 0))
+            bbox.append((detected_bbox["x"], detected_bbox["y"],
+                         detected_bbox["width"], detected_bbox["height"]))
+        return cls(
+            uuids, cam_ids, bboxes_px,
+            np.array(velocity, dtype=float).reshape(-1, 3),
+            np.array(translation, dtype=float).reshape(-1, 3),
+            np.array(size, dtype=float).reshape(-1, 3),
+            np.array(bbox, dtype=float).reshape(-1, 4))
 
-            velocity = obj.get("velocity", [0, 0, 0])
-            v_mag = float(np.linalg.norm(velocity))
-
-            if "bounding_box_px" in obj and "bounding_box_camera_id" in obj:
-                cam_id = obj["bounding_box_camera_id"]
-                detected_bbox = obj["bounding_box_px"]
-                detected_bbox_xyxy = {
-                    "x_min": detected_bbox["x"],
-                    "y_min": detected_bbox["y"],
-                    "x_max": detected_bbox["x"] + detected_bbox["width"],
-                    "y_max": detected_bbox["y"] + detected_bbox["height"],
-                }
-                cam_extrinsics = camera_calibrations.get(
-                    cam_id, {}).get("extrinsics")
-                intrinsics = camera_calibrations.get(
-                    cam_id, {}).get("intrinsics")
-                distortion = camera_calibrations.get(
-                    cam_id, {}).get("distortion")
-
-                canonical_bbox = None
-                if intrinsics and distortion and cam_extrinsics:
-                    canonical_bbox = get_canonical_bbox(
-                        obj, intrinsics, distortion, cam_extrinsics)
-                    if canonical_bbox is not None:
-                        canonical_bboxes[cam_id] = canonical_bbox
-
-                # Aspect ratio ratio
-                def bbox_ar(b):
-                    w = b["x_max"] - b["x_min"]
-                    h = b["y_max"] - b["y_min"]
-                    return h / w if w > 0 else 0
-
-                aspect_ratio_detected = bbox_ar(detected_bbox_xyxy)
-                aspect_ratio_canonical = bbox_ar(
-                    canonical_bbox) if canonical_bbox else 1
-                aspect_ratio_ratio = aspect_ratio_detected / \
-                    aspect_ratio_canonical if aspect_ratio_canonical > 0 else 0
-
-                # Calculate area and update area history
-                area = detected_bbox["width"] * detected_bbox["height"]
-                now = time.time()
-                area_hist = bb_area_history[uuid][cam_id]
-                area_hist.append((now, area))
-                while area_hist and now - area_hist[0][0] > window_seconds:
-                    area_hist.popleft()
-                smoothed_area, area_rate = compute_smoothed_area_and_rate(
-                    area_hist)
-
-                # Clip flags
-                resolution = camera_calibrations.get(
-                    cam_id, {}).get("resolution")
-                clip_flags = bbox_clip_flags(
-                    detected_bbox, resolution) if detected_bbox and resolution else [0, 0, 0, 0]
-
-                # Compose feature vector
-                feature_vector = [
-                    aspect_ratio_ratio,
-                    v_mag,
-                    smoothed_area,
-                    area_rate,
-                    *clip_flags
-                ]
-
-                # Store in rolling window for weighted average
-                fhist = feature_history[uuid][cam_id]
-                fhist.append((now, feature_vector))
-                while fhist and now - fhist[0][0] > window_seconds:
-                    fhist.popleft()
-
-                # Weighted average: newer samples weighted higher
-                if fhist:
-                    times = np.array([t for t, _ in fhist])
-                    features = np.array([fv for _, fv in fhist])
-                    if len(times) > 1:
-                        weights = np.linspace(1, 2, len(times))
-                    else:
-                        weights = np.array([1.0])
-                    weights /= weights.sum()
-                    feature_vector_smoothed = np.average(
-                        features, axis=0, weights=weights).tolist()
+    def take(self, rows):
+        """Returns a new frame holding only the given row indices."""
+        return PersonFrame(
+            [self.uuids[i] for i in rows], [self.cam_ids[i] for i in rows],
+            [self.bboxes_px[i] for i in rows], self.velocity[rows],
+            self.translation[rows], self.size[rows], self.bbox[rows])
+
+    def __len__(self):
+        return len(self.uuids)
+
+    def camera_groups(self):
+        """Yields (cam_id, row indices) for each camera present in the frame."""
+        groups = defaultdict(list)
+        for i, cam_id in enumerate(self.cam_ids):
+            groups[cam_id].append(i)
+        for cam_id, rows in groups.items():
+            yield cam_id, np.array(rows)
+
+def resolve_cameras(frame, scene):
+    """Returns (cam_id, rows, CameraProjection or None, resolution) per camera in the frame."""
+    cache = scene.calibration_cache
+    cameras = []
+    for cam_id, rows in frame.camera_groups():
+        resolution = cache.calibrations.get(cam_id, {}).get("resolution")
+        cameras.append((cam_id, rows, cache.get(cam_id), resolution))
+    return cameras
+
+def frame_canonical_bboxes(frame, cameras, counters=None):
+    """Returns (N, 4) canonical xyxy boxes, NaN rows for uncalibrated or grid cameras."""
+    canonical = np.full((len(frame), 4), np.nan)
+    for cam_id, rows, camera, resolution in cameras:
+        if camera is None or camera.grid is not None:
+            continue
+        if camera.bbox_cache is not None:
+            canonical[rows] = camera.bbox_cache.project(
+                frame.translation[rows], frame.size[rows], camera, counters)
+            continue
+        canonical[rows] = project_canonical_bboxes(
+            frame.translation[rows], frame.size[rows], camera)
+    return canonical
+
+def bbox_aspect_ratios(widths, heights):
+    """Height / width per box, 0 where the width is not positive."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(widths > 0, heights / widths, 0.0)
+
+def canonical_aspect_ratios(frame, canonical, cameras):
+    """Canonical aspect ratio per row, from the boxes or the camera's grid.
+
+    Rows without a canonical value (no calibration, outside the grid's valid
+    region) get 1, which leaves the detected aspect ratio as it is.
+    """
+    aspect_ratio = bbox_aspect_ratios(
+        canonical[:, 2] - canonical[:, 0], canonical[:, 3] - canonical[:, 1])
+    aspect_ratio[np.isnan(canonical[:, 0])] = 1
+    for cam_id, rows, camera, resolution in cameras:
+        if camera is None or camera.grid is None:
+            continue
+        looked_up, _ = camera.grid.lookup(frame.translation[rows], frame.size[rows])
+        aspect_ratio[rows] = np.where(np.isnan(looked_up), 1, looked_up)
+    return aspect_ratio
+
+def frame_clip_flags(frame, cameras, margin=2):
+    """Returns (N, 4) 0/1 flags [clip_left, clip_right, clip_top, clip_bottom] per row.
+
+    A box is clipped on a side within `margin` pixels of the image border; rows
+    from cameras without a known resolution get no flags.
+    """
+    resolution = np.full((len(frame), 2), np.nan)
+    for cam_id, rows, camera, cam_resolution in cameras:
+        if cam_resolution:
+            resolution[rows] = cam_resolution
+    x, y, w, h = frame.bbox.T
+    img_w, img_h = resolution.T
+    with np.errstate(invalid="ignore"):
+        flags = np.stack([
+            x <= margin,
+            (x + w) >= (img_w - margin),
+            y <= margin,
+            (y + h) >= (img_h - margin),
+        ], axis=1)
+    flags[np.isnan(img_w) | np.isnan(img_h)] = False
+    return flags.astype(int)
+
+def compute_frame_features(frame, aspect_ratio_canonical, cameras):
+    """Returns the (N, 8) raw feature matrix for a frame.
+
+    Columns are [aspect_ratio_ratio, v_mag, smoothed_area, area_rate,
+    clip_left, clip_right, clip_top, clip_bottom]. The area columns hold the
+    instantaneous bbox area and 0 until the caller folds in area history.
+    """
+    features = np.zeros((len(frame), 8))
+    aspect_ratio_detected = bbox_aspect_ratios(frame.bbox[:, 2], frame.bbox[:, 3])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        features[:, 0] = np.where(aspect_ratio_canonical > 0,
+                                  aspect_ratio_detected / aspect_ratio_canonical, 0.0)
+    features[:, 1] = np.linalg.norm(frame.velocity, axis=1)
+    features[:, 2] = frame.bbox[:, 2] * frame.bbox[:, 3]
+    features[:, 4:] = frame_clip_flags(frame, cameras)
+    return features
+
+def classify_states(features, args):
+    """Returns the STATE_PRIORITY index for every row of a smoothed feature matrix."""
+    aspect_ratio_ratio, v_mag, area_rate, clip_bottom = (
+        features[:, 0], features[:, 1], features[:, 3], features[:, 7])
+    fallen = (aspect_ratio_ratio < args.fallen_arr_threshold) & ~(
+        (clip_bottom != 0) & (np.abs(area_rate) > args.area_rate_threshold))
+    return np.select(
+        [v_mag >= args.run_velocity_threshold,
+         v_mag >= args.walk_velocity_threshold,
+         fallen],
+        [STATE_INDEX["running"], STATE_INDEX["walking"], STATE_INDEX["fallen"]],
+        default=STATE_INDEX["standing"])
+
+KEYFRAME_REQUEST_SUFFIX = "/keyframe-request"
+
+def scene_id_from_topic(topic):
+    return topic.rsplit("/", 1)[-1]
+
+def record_stage(timings, stage, start):
+    """Adds the time since start to timings[stage] and returns the current time."""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
+
+def compute_person_metrics(scene, frame, args, now, timings=None, counters=None):
+    """Runs feature extraction, smoothing and classification for a frame.
+
+    Returns ({uuid: consensus STATE_PRIORITY index}, PersonMetrics).
+    Only the scene's histories are touched, so frames can be split by uuid.
+    Per-stage durations are added to timings and event counts (canonical box
+    cache hits and misses, rolling window overflows) to counters when they are
+    given.
+    """
+    window_seconds = args.window_seconds
+
+    # 1. Per-observation features for all people in the frame at once
+    t = time.perf_counter()
+    cameras = resolve_cameras(frame, scene)
+    t = record_stage(timings, "calibration_lookup", t)
+    canonical = frame_canonical_bboxes(frame, cameras, counters)
+    aspect_ratio_canonical = canonical_aspect_ratios(frame, canonical, cameras)
+    t = record_stage(timings, "canonical_bbox", t)
+    features = compute_frame_features(frame, aspect_ratio_canonical, cameras)
+    t = record_stage(timings, "features", t)
+
+    # Rolling windows of every (uuid, camera) at once, see HistoryStore
+    history = scene.history_store(args.history_capacity)
+    overflows = history.overflows
+    slots = history.slots(frame.uuids, frame.cam_ids)
+    smoothed = np.empty_like(features)
+    for rows in distinct_slot_passes(slots):
+        pass_slots = slots[rows]
+        newest = history.append(pass_slots, now, window_seconds)
+        history.fill(pass_slots, newest, AREA_COLUMN, features[rows, 2])
+        features[rows, 2] = history.weighted_mean(pass_slots, AREA_COLUMN)
+        features[rows, 3] = history.slope(pass_slots, AREA_COLUMN)
+
+        # Weighted average: newer samples weighted higher
+        history.fill(pass_slots, newest, FEATURE_COLUMNS, features[rows])
+        smoothed[rows] = history.weighted_mean(pass_slots, FEATURE_COLUMNS)
+    overflows = history.overflows - overflows
+    if counters is not None and overflows:
+        counters["history_overflows"] = counters.get("history_overflows", 0) + overflows
+    t = record_stage(timings, "history", t)
+
+    state_indices = classify_states(smoothed, args).astype(np.int8)
+
+    rows = defaultdict(list)
+    consensus = {}
+    for i, (uuid, state_index) in enumerate(zip(frame.uuids, state_indices.tolist())):
+        consensus[uuid] = min(consensus.get(uuid, state_index), state_index)
+        rows[uuid].append(i)
+    metrics = PersonMetrics(frame.cam_ids, frame.bboxes_px, canonical, features, smoothed,
+                            state_indices, rows)
+
+    record_stage(timings, "classification", t)
+    return consensus, metrics
+
+def process_scene_message(scene, data, args, shard_pool=None, timings=None, counters=None):
+    """Updates the scene's tracker from a decoded scene message and returns the summary."""
+    started = time.perf_counter()
+    timestamp = data.get("timestamp")
+    frame = PersonFrame.from_objects(data.get("objects", []))
+    now = time.time()
+    shedder = scene.load_shedder
+    shed = []
+    if shedder is not None:
+        rows, shed = shedder.select(frame, scene.tracked_people)
+        if rows is not None:
+            frame = frame.take(rows)
+    t = time.perf_counter()
+    if shard_pool is not None:
+        consensus, frame_metrics = shard_pool.compute_person_metrics(
+            scene.scene_id, frame, now, timings, counters)
+    else:
+        consensus, metrics = compute_person_metrics(scene, frame, args, now, timings, counters)
+        frame_metrics = [metrics]
+    person_seconds = time.perf_counter() - t
+    t = time.perf_counter()
+
+    # Shed people keep their last state and metrics, but stay active
+    for uuid in shed:
+        scene.tracked_people[uuid].last_seen = now
+        scene.tracked_people.move_to_end(uuid)
+
+    # 2. Aggregate and determine state per person, and update tracked_people
+    tracked_people = scene.tracked_people
+    people = [(uuid, rows, metrics) for metrics in frame_metrics
+              for uuid, rows in metrics.rows.items()]
+    if len(frame_metrics) > 1:
+        # Shards reply grouped by owner; restore the frame order inline processing uses
+        first_row = {}
+        for i, uuid in enumerate(frame.uuids):
+            first_row.setdefault(uuid, i)
+        people.sort(key=lambda person: first_row[person[0]])
+    for uuid, rows, metrics in people:
+        # Consensus: the "most severe" state by priority
+        state = consensus[uuid]
+        track = tracked_people.get(uuid)
+        if track is None:
+            track = tracked_people[uuid] = Track(uuid, state, now, now)
+        elif track.state != state:
+            track.state = state
+            track.state_start_time = now
+        track.last_seen = now
+        cam_ids = metrics.cam_ids
+        if len(rows) != len(track.camera_ids) or any(
+                cam_ids[i] != cam_id for i, cam_id in zip(rows, track.camera_ids)):
+            track.camera_ids = tuple(dict.fromkeys(intern_camera_id(cam_ids[i]) for i in rows))
+        track.metrics = metrics
+        track.rows = rows
+        tracked_people.move_to_end(uuid)
+
+    expired = scene.expire_tracks(now, args.track_ttl, args.max_tracks)
+    if shard_pool is not None and expired:
+        shard_pool.forget(scene.scene_id, expired)
+
+    # 3. Gather all people seen within the rolling window, counting people in each state
+    counts = [0] * len(STATE_PRIORITY)
+    active_people = []
+    for track in scene.active_tracks(now, args.window_seconds):
+        counts[track.state] += 1
+        active_people.append(track.to_json(args.verbose_metrics))
+    state_counts = {state: counts[STATE_INDEX[state]] for state in STATE_COUNT_ORDER}
+
+    record_stage(timings, "aggregation", t)
+    if counters is not None:
+        # Rows of the frame that went through feature extraction, after shedding
+        counters["people_processed"] = counters.get("people_processed", 0) + len(frame)
+    if shedder is not None:
+        overrun = shedder.observe(len(frame), person_seconds, time.perf_counter() - started)
+        if counters is not None:
+            counters["people_shed"] = counters.get("people_shed", 0) + len(shed)
+            counters["frame_budget_overruns"] = counters.get("frame_budget_overruns", 0) + int(overrun)
+    return {
+        "timestamp": timestamp,
+        "state_counts": state_counts,
+        "scene_id": scene.scene_id,
+        "people": active_people
+    }
+
+def shard_for(uuid, shard_count):
+    # crc32 rather than hash() so every process agrees on the owner of a uuid
+    return zlib.crc32(uuid.encode("utf-8")) % shard_count
+
+def shard_worker(conn, args):
+    """Process pool entry point owning the histories of one uuid shard."""
+    options = projection_options(args)
+    scenes = {}
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        kind, scene_id = request[0], request[1]
+        try:
+            if kind == "calibrations":
+                if scene_id in scenes:
+                    scenes[scene_id].update_calibrations(request[2])
                 else:
-                    feature_vector_smoothed = feature_vector
-
-                person_features[uuid].append(
-                    (feature_vector_smoothed, cam_id))
-
-                # State logic (unpack features)
-                aspect_ratio_ratio, v_mag, smoothed_area, area_rate, clip_left, clip_right, clip_top, clip_bottom = feature_vector_smoothed
-                arr_thresh = args.fallen_arr_threshold
-                area_rate_threshold = args.area_rate_threshold
-
-                if v_mag >= args.run_velocity_threshold:
-                    state = "running"
-                elif v_mag >= args.walk_velocity_threshold:
-                    state = "walking"
-                elif (
-                    aspect_ratio_ratio < arr_thresh
-                    and not (clip_bottom and abs(area_rate) > area_rate_threshold)
-                ):
-                    state = "fallen"
+                    scenes[scene_id] = SceneState(scene_id, request[2], **options)
+            elif kind == "forget":
+                for uuid in request[2]:
+                    scenes[scene_id].forget_history(uuid)
+            elif kind == "frame":
+                _, _, frame, now = request
+                timings, counters = {}, {}
+                result = compute_person_metrics(
+                    scenes[scene_id], frame, args, now, timings, counters)
+                conn.send(("ok", (*result, timings, counters)))
+        except Exception as e:
+            if kind == "frame":
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+            else:
+                print(f"Shard worker failed to handle {kind} for scene {scene_id}: {e}")
+    conn.close()
+
+class ShardPool:
+    """Splits person observations across worker processes by uuid.
+
+    Each process keeps the feature and area histories of the uuids it owns,
+    so per-person work runs in parallel without sharing state. The caller
+    merges the returned per-person results into the scene summary. A shard
+    whose process died is restarted with the current calibrations; the
+    histories it owned start over.
+    """
+
+    def __init__(self, processes, args, scenes):
+        import multiprocessing
+        self.context = multiprocessing.get_context("spawn")
+        self.args = args
+        self.calibrations = {scene.scene_id: scene.camera_calibrations for scene in scenes}
+        self.connections = [None] * processes
+        self.processes = [None] * processes
+        # One frame is scattered and gathered at a time; the pool parallelizes within it
+        self.lock = threading.Lock()
+        for shard in range(processes):
+            self._start(shard)
+
+    def _start(self, shard):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=shard_worker, args=(child_conn, self.args),
+                                       name=f"fall-detection-shard-{shard}", daemon=True)
+        process.start()
+        child_conn.close()
+        self.connections[shard] = parent_conn
+        self.processes[shard] = process
+        for scene_id, camera_calibrations in self.calibrations.items():
+            parent_conn.send(("calibrations", scene_id, camera_calibrations))
+
+    def _restart(self, shard):
+        process = self.processes[shard]
+        process.join(timeout=1)
+        print(f"Shard process {shard} died (exit code {process.exitcode}), restarting it")
+        self.connections[shard].close()
+        self._start(shard)
+
+    def _send(self, shard, request):
+        """Sends a request to a shard, returning False if its process is gone."""
+        try:
+            self.connections[shard].send(request)
+            return True
+        except OSError:
+            return False
+
+    def _broadcast(self, request):
+        with self.lock:
+            for shard in range(len(self.connections)):
+                if not self._send(shard, request) and request is not None:
+                    self._restart(shard)
+
+    def set_calibrations(self, scene_id, camera_calibrations):
+        self.calibrations[scene_id] = camera_calibrations
+        self._broadcast(("calibrations", scene_id, camera_calibrations))
+
+    def forget(self, scene_id, uuids):
+        self._broadcast(("forget", scene_id, uuids))
+
+    def compute_person_metrics(self, scene_id, frame, now, timings=None, counters=None):
+        shard_rows = defaultdict(list)
+        for i, uuid in enumerate(frame.uuids):
+            shard_rows[shard_for(uuid, len(self.connections))].append(i)
+        consensus, frame_metrics = {}, []
+        errors, dead = [], []
+        with self.lock:
+            sent = []
+            for shard, rows in shard_rows.items():
+                if self._send(shard, ("frame", scene_id, frame.take(rows), now)):
+                    sent.append(shard)
                 else:
-                    state = "standing"
+                    dead.append(shard)
+            # Every shard that got a slice replies, even if another one failed,
+            # so no reply is left in a pipe to be read as the next frame's
+            for shard in sent:
+                try:
+                    status, result = self.connections[shard].recv()
+                except (EOFError, OSError):
+                    dead.append(shard)
+                    continue
+                if status != "ok":
+                    errors.append(f"shard {shard} failed: {result}")
+                    continue
+                shard_consensus, shard_metrics, shard_timings, shard_counters = result
+                consensus.update(shard_consensus)
+                frame_metrics.append(shard_metrics)
+                # Shards run in parallel, so a stage takes as long as its slowest shard
+                if timings is not None:
+                    for stage, seconds in shard_timings.items():
+                        timings[stage] = max(timings.get(stage, 0.0), seconds)
+                if counters is not None:
+                    for name, value in shard_counters.items():
+                        counters[name] = counters.get(name, 0) + value
+            for shard in dead:
+                self._restart(shard)
+                errors.append(f"shard {shard} process died")
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return consensus, frame_metrics
 
-                bb_canonical_xyxy = canonical_bboxes.get(cam_id)
-                bb_canonical = xyxy_to_xywh(
-                    bb_canonical_xyxy) if bb_canonical_xyxy else None
-
-                metrics_by_uuid[uuid][cam_id] = {
-                    "bounding_box_px": detected_bbox,
-                    "bb_canonical": bb_canonical,
-                    "feature_vector": feature_vector,
-                    "feature_vector_smoothed": feature_vector_smoothed,
-                    "state": state
-                }
+    def close(self):
+        self._broadcast(None)
+        for process in self.processes:
+            process.join(timeout=5)
 
-        # 2. Aggregate and determine state per person, and update tracked_people
-        now = time.time()
-        state_priority = ["fallen", "falling",
-                          "running", "walking", "standing", "unknown"]
-
-        for uuid, feats in person_features.items():
-            metrics = metrics_by_uuid[uuid]
-            # Consensus: pick the "most severe" state by priority
-            final_state = sorted(
-                metrics.values(), key=lambda x: state_priority.index(x["state"]))[0]["state"]
-            cams_seen = set(metrics.keys())
-            prev = tracked_people.get(uuid)
-            if prev and prev["state"] == final_state:
-                state_start_time = prev.get("state_start_time", now)
-            else:
-                state_start_time = now
-            state_duration = now - state_start_time
-
-            tracked_people[uuid] = {
-                "uuid": uuid,
-                "state": final_state,
-                "state_duration": state_duration,
-                "state_start_time": state_start_time,
-                "camera_ids": list(cams_seen),
-                "last_seen": now,
-                "metrics": metrics
-            }
+class FrameQueue:
+    """Work queue between the MQTT network thread and processing workers.
+
+    Each scene has at most one pending frame: a newer frame replaces the one
+    waiting and counts as dropped, so workers always see the latest state. A
+    scene is handed to one worker at a time, which keeps its tracker state
+    single-threaded. Frames for new scenes beyond max_scenes are rejected.
+    """
+
+    def __init__(self, max_scenes):
+        self.max_scenes = max_scenes
+        self.dropped = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._ready = deque()
+        self._busy = set()
+
+    def put(self, scene_id, payload):
+        with self._cond:
+            if scene_id in self._pending:
+                self._pending[scene_id] = payload
+                self.dropped += 1
+                return
+            if len(self._pending) >= self.max_scenes:
+                self.rejected += 1
+                return
+            self._pending[scene_id] = payload
+            if scene_id not in self._busy:
+                self._ready.append(scene_id)
+                self._cond.notify()
+
+    def get(self):
+        with self._cond:
+            while not self._ready:
+                self._cond.wait()
+            scene_id = self._ready.popleft()
+            self._busy.add(scene_id)
+            return scene_id, self._pending.pop(scene_id)
+
+    def done(self, scene_id):
+        with self._cond:
+            self._busy.discard(scene_id)
+            if scene_id in self._pending:
+                self._ready.append(scene_id)
+                self._cond.notify()
+
+class CalibrationRefresher:
+    """Background re-poll of each scene's cameras for hot calibration reloads.
+
+    Requests go over one pooled requests.Session and are conditional on the
+    last ETag / Last-Modified, so an unchanged scene costs a 304. Projection
+    matrices are rebuilt on this thread and swapped in with
+    SceneState.update_calibrations; the message path never waits on it.
+    Scenes listed in `reconcile` (started from a snapshot) are fetched right
+    away and retried until the API answers, regardless of `interval`.
+    """
+
+    def __init__(self, resturl, api_key, insecure, scenes, interval, on_change=None,
+                 reconcile=(), retry_delay=5):
+        self.resturl = resturl
+        self.insecure = insecure
+        self.scenes = scenes
+        self.interval = interval
+        self.on_change = on_change
+        self.reconcile = set(reconcile)
+        self.retry_delay = retry_delay
+        self.api_key = api_key
+        # Created on first use so requests is imported off the startup path
+        self.session = None
+        self.validators = {}
+        self.reloads = 0
+        self.failures = 0
+
+    def start(self):
+        threading.Thread(target=self.run, name="calibration-refresher", daemon=True).start()
 
-        # 3. Gather all people seen within the rolling window
-        active_people = [
-            {k: v for k, v in person.items() if k not in (
-                "last_seen", "state_start_time")}
-            for person in tracked_people.values()
-            if now - person["last_seen"] < window_seconds
-        ]
-
-        # Count people in each state
-        state_counts = {"fallen": 0, "standing": 0,
-                        "walking": 0, "running": 0, "falling": 0, "unknown": 0}
-        for person in active_people:
-            state = person.get("state", "unknown")
-            if state in state_counts:
-                state_counts[state] += 1
+    def run(self):
+        pending = self.reconcile
+        while pending:
+            pending = self.refresh_all(pending)
+            if pending:
+                time.sleep(self.retry_delay)
             else:
-                state_counts["unknown"] += 1
-
-        scene_id = userdata.get("scene_id", "unknown")
-        publish_topic = f"scenescape/fall-detection/{scene_id}"
-        message = {
-            "timestamp": timestamp,
-            "state_counts": state_counts,
-            "scene_id": scene_id,
-            "people": active_people
-        }
-        client.publish(publish_topic, json.dumps(message))
+                print("Reconciled snapshot calibrations with the REST API")
+        while self.interval > 0:
+            time.sleep(self.interval)
+            self.refresh_all(list(self.scenes))
+
+    def refresh_all(self, scene_ids):
+        """Refreshes the given scenes; returns the ids that failed."""
+        failed = set()
+        for scene_id in scene_ids:
+            try:
+                self.refresh(self.scenes[scene_id])
+            except Exception as e:
+                self.failures += 1
+                failed.add(scene_id)
+                print(f"Failed to refresh calibrations for scene {scene_id}: {e}",
+                      file=sys.stderr)
+        return failed
+
+    def refresh(self, scene):
+        """Re-fetches one scene's cameras; returns the ids of changed cameras."""
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+            self.session.headers["Authorization"] = f"Token {self.api_key}"
+        headers = {}
+        etag, last_modified = self.validators.get(scene.scene_id, (None, None))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response = self.session.get(
+            f"{self.resturl}/cameras?scene={scene.scene_id}",
+            headers=headers,
+            verify=not self.insecure,
+            timeout=10
+        )
+        if response.status_code == 304:
+            return set()
+        response.raise_for_status()
+        self.validators[scene.scene_id] = (
+            response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        changed = scene.update_calibrations(build_camera_calibrations(response.json()))
+        if changed:
+            self.reloads += 1
+            print(f"Reloaded calibrations for scene {scene.scene_id}, "
+                  f"changed cameras: {', '.join(sorted(changed))}")
+            if self.on_change is not None:
+                self.on_change(scene, changed)
+        return changed
+
+def publish_summary(client, userdata, scene, message):
+    args = userdata["args"]
+    metrics = userdata["metrics"]
+    t = time.perf_counter()
+    if args.output_mode == "delta":
+        message = scene.delta_encoder.encode(message, time.time(), args.keyframe_interval)
+    payload = userdata["codec"].dumps(message)
+    t2 = time.perf_counter()
+    client.publish(scene.publish_topic, payload)
+    metrics.observe_stage("serialization", t2 - t)
+    metrics.observe_stage("publish", time.perf_counter() - t2)
+    metrics.inc("published_total", scene=scene.scene_id)
+    if "first_publish_at" not in userdata:
+        userdata["first_publish_at"] = time.time()
+        print(f"First summary published {userdata['first_publish_at'] - userdata['started_at']:.2f}s "
+              f"after startup")
+
+def handle_scene_payload(client, userdata, scene, payload):
+    metrics = userdata["metrics"]
+    metrics.inc("messages_total", scene=scene.scene_id)
+    try:
+        t = time.perf_counter()
+        data = userdata["codec"].decode_scene(payload)
+        timings = {"decode": time.perf_counter() - t}
+        counters = {}
+        message = process_scene_message(
+            scene, data, userdata["args"], userdata.get("shard_pool"), timings, counters)
+        metrics.observe_stages(timings)
+        for name, value in counters.items():
+            metrics.inc(f"{name}_total", value, scene=scene.scene_id)
+        now = time.time()
+        state_sink = userdata.get("state_sink")
+        if state_sink is not None:
+            state_sink.record(scene.scene_id, message, now)
+        snapshotter = userdata.get("tracker_snapshotter")
+        if snapshotter is not None and snapshotter.due(scene.scene_id, now):
+            snapshotter.submit(scene.scene_id, capture_tracker_state(
+                scene, now, userdata["args"].window_seconds), now)
+        if scene.publish_scheduler is not None:
+            scene.publish_scheduler.submit(message, time.time())
+        else:
+            publish_summary(client, userdata, scene, message)
 
     except Exception as e:
+        metrics.inc("errors_total", scene=scene.scene_id)
         print(f"Error decoding MQTT message: {e}")
 
+def stats_publisher(client, userdata, interval):
+    """Periodically publishes a metrics snapshot on each scene's stats topic."""
+    while True:
+        time.sleep(interval)
+        for scene in userdata["scenes"].values():
+            snapshot = userdata["metrics"].snapshot(scene=scene.scene_id)
+            snapshot["scene_id"] = scene.scene_id
+            snapshot["timestamp"] = time.time()
+            client.publish(f"{scene.publish_topic}/stats", userdata["codec"].dumps(snapshot))
+
+def register_metrics(metrics, userdata):
+    metrics.describe("messages_total", "Scene messages handed to processing.")
+    metrics.describe("people_processed_total",
+                     "Person detections (one per person and camera) processed, after load shedding.")
+    metrics.describe("errors_total", "Scene messages that failed processing.")
+    metrics.describe("published_total", "Summaries published.")
+    metrics.describe("frames_dropped_total", "Frames skipped for a newer frame of the same scene.")
+    metrics.describe("frames_rejected_total", "Frames rejected because the work queue was full.")
+    metrics.describe("summaries_coalesced_total", "Summaries replaced before the rate limiter published them.")
+    metrics.describe("recorder_dropped_total", "Scene messages the recorder could not queue.")
+    metrics.describe("calibration_reloads_total", "Scene calibration reloads that changed a camera.")
+    metrics.describe("calibration_refresh_failures_total", "Failed calibration re-polls.")
+    metrics.describe("canonical_cache_hits_total", "Canonical boxes served from the pose cache.")
+    metrics.describe("canonical_cache_misses_total", "Canonical boxes projected on a pose cache miss.")
+    metrics.describe("history_overflows_total",
+                     "Samples dropped from a full rolling window before leaving --window-seconds.")
+    metrics.describe("people_shed_total", "Person updates skipped by load shedding.")
+    metrics.describe("frame_budget_overruns_total", "Frames processed over --frame-budget-ms.")
+    metrics.describe("load_shed_stride", "Frames between updates of fast-moving people (1: no shedding).",
+                     "gauge")
+    metrics.describe("state_db_rows_written_total", "Rows committed to --state-db.")
+    metrics.describe("state_db_dropped_total", "Summaries the state database writer could not queue.")
+    metrics.describe("tracker_snapshots_written_total", "Tracker state snapshots written.")
+    metrics.describe("tracker_snapshot_failures_total", "Tracker state snapshots that failed to write.")
+    metrics.describe("startup_to_first_publish_seconds",
+                     "Seconds from process start to the first published summary.", "gauge")
+    metrics.register_callback(
+        "startup_to_first_publish_seconds",
+        lambda: userdata.get("first_publish_at", userdata["started_at"]) - userdata["started_at"])
+    frame_queue = userdata.get("frame_queue")
+    if frame_queue is not None:
+        metrics.register_callback("frames_dropped_total", lambda: frame_queue.dropped)
+        metrics.register_callback("frames_rejected_total", lambda: frame_queue.rejected)
+    for scene in userdata["scenes"].values():
+        if scene.publish_scheduler is not None:
+            metrics.register_callback(
+                "summaries_coalesced_total",
+                lambda scheduler=scene.publish_scheduler: scheduler.coalesced,
+                scene=scene.scene_id)
+        if scene.load_shedder is not None:
+            metrics.register_callback(
+                "load_shed_stride", lambda shedder=scene.load_shedder: shedder.stride,
+                scene=scene.scene_id)
+    recorder = userdata.get("recorder")
+    if recorder is not None:
+        metrics.register_callback("recorder_dropped_total", lambda: recorder.dropped)
+    refresher = userdata.get("calibration_refresher")
+    if refresher is not None:
+        metrics.register_callback("calibration_reloads_total", lambda: refresher.reloads)
+        metrics.register_callback("calibration_refresh_failures_total", lambda: refresher.failures)
+    state_sink = userdata.get("state_sink")
+    if state_sink is not None:
+        metrics.register_callback("state_db_rows_written_total", lambda: state_sink.rows_written)
+        metrics.register_callback("state_db_dropped_total", lambda: state_sink.dropped)
+    snapshotter = userdata.get("tracker_snapshotter")
+    if snapshotter is not None:
+        metrics.register_callback("tracker_snapshots_written_total", lambda: snapshotter.written)
+        metrics.register_callback("tracker_snapshot_failures_total", lambda: snapshotter.failures)
+
+def processing_worker(client, userdata, frame_queue):
+    userdata["profiler"].register_current_thread()
+    last_dropped = 0
+    last_report = time.time()
+    while True:
+        scene_id, payload = frame_queue.get()
+        try:
+            handle_scene_payload(client, userdata, userdata["scenes"][scene_id], payload)
+        finally:
+            frame_queue.done(scene_id)
+        if time.time() - last_report >= 60 and frame_queue.dropped != last_dropped:
+            print(f"Skipped {frame_queue.dropped - last_dropped} stale frames in the last minute "
+                  f"({frame_queue.dropped} total, {frame_queue.rejected} rejected)")
+            last_dropped = frame_queue.dropped
+            last_report = time.time()
+
+def on_message(client, userdata, msg):
+    if msg.topic.endswith(KEYFRAME_REQUEST_SUFFIX):
+        scene = userdata["scenes"].get(msg.topic.split("/")[-2])
+        if scene is not None:
+            scene.delta_encoder.keyframe_requested = True
+        return
+    recorder = userdata.get("recorder")
+    if recorder is not None:
+        recorder.record(msg.topic, msg.payload)
+        if userdata["args"].record_only:
+            return
+    scene_id = scene_id_from_topic(msg.topic)
+    scene = userdata["scenes"].get(scene_id)
+    if scene is None:
+        if scene_id not in userdata["ignored_scenes"]:
+            userdata["ignored_scenes"].add(scene_id)
+            print(f"Ignoring messages for unconfigured scene {scene_id}")
+        return
+    frame_queue = userdata.get("frame_queue")
+    if frame_queue is not None:
+        frame_queue.put(scene_id, msg.payload)
+    else:
+        handle_scene_payload(client, userdata, scene, msg.payload)
+
 def initialize_mqtt_client(**kwargs):
     if hasattr(mqtt, 'CallbackAPIVersion'):
         return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, **kwargs)
     else:
         return mqtt.Client(**kwargs)
 
-def world_to_camera(pt_world, cam_extrinsics):
-    t = np.array(cam_extrinsics["translation"])
-    q = cam_extrinsics["rotation"]
-    pose_mat = transform.CameraPose.poseToPoseMat(t, q, [1, 1, 1])
-    pt_world_h = np.array([*pt_world, 1.0])
-    world_to_cam = np.linalg.inv(pose_mat)
-    pt_cam_h = world_to_cam @ pt_world_h
-    pt_cam = pt_cam_h[:3]
-    return pt_cam.tolist()
+def world_to_camera(pts_world, world_to_cam):
+    pts_world_h = np.hstack([pts_world, np.ones((len(pts_world), 1))])
+    pts_cam_h = pts_world_h @ world_to_cam.T
+    return pts_cam_h[:, :3]
 
 def bbox_from_pose(pose):
     points = [pt for pt in pose if pt and len(pt) == 2]
@@ -377,21 +2246,141 @@ def xyxy_to_xywh(box):
         "height": height
     }
 
-def bbox_clip_flags(bbox, resolution, margin=2):
-    """Returns a list of 0/1 flags for [clip_left, clip_right, clip_top, clip_bottom]."""
-    if not bbox or not resolution:
-        return [0, 0, 0, 0]
-    x, y, w, h = bbox["x"], bbox["y"], bbox["width"], bbox["height"]
-    img_w, img_h = resolution
-    return [
-        int(x <= margin),                      # clip_left
-        int((x + w) >= (img_w - margin)),      # clip_right
-        int(y <= margin),                      # clip_top
-        int((y + h) >= (img_h - margin)),      # clip_bottom
-    ]
+def get_served_scene_ids(args, api_key):
+    if not args.all_scenes:
+        return args.scene_uuid
+    # With snapshots to fall back on, don't sit through the retries
+    snapshot_ids = list_calibration_snapshots(args.calibration_snapshot_dir)
+    return get_scene_ids(f"{args.resturl}/scenes", api_key, args.insecure,
+                         retries=1 if snapshot_ids else 5) or snapshot_ids
+
+def scene_topics(args, scene_ids):
+    """Returns (scene message topic, keyframe request topic or None)."""
+    # A single scene keeps its exact topics; several share wildcard subscriptions
+    topic_scene = scene_ids[0] if len(scene_ids) == 1 and not args.all_scenes else "+"
+    keyframe_topic = None
+    if args.output_mode == "delta":
+        keyframe_topic = f"scenescape/fall-detection/{topic_scene}{KEYFRAME_REQUEST_SUFFIX}"
+    return f"scenescape/regulated/scene/{topic_scene}", keyframe_topic
+
+def load_scene(args, scene_id, api_key, options):
+    """Returns (SceneState or None, whether it was loaded from a calibration snapshot)."""
+    scene = scene_from_snapshot(args, scene_id, options)
+    if scene is not None:
+        return scene, True
+    api_url = f"{args.resturl}/cameras?scene={scene_id}"
+    print(f"API URL: {api_url}")
+    cameras = get_cameras(api_url, api_key, args.insecure)
+    if cameras is None:
+        print(f"Failed to retrieve cameras for scene {scene_id}.", file=sys.stderr)
+        return None, False
+    return scene_from_cameras(args, scene_id, cameras, options), False
+
+def scene_from_snapshot(args, scene_id, options):
+    """Returns a SceneState built from the scene's calibration snapshot, or None."""
+    if not args.calibration_snapshot_dir:
+        return None
+    cache = load_calibration_snapshot(args.calibration_snapshot_dir, scene_id, **options)
+    return SceneState(scene_id, None, cache) if cache is not None else None
+
+def scene_from_cameras(args, scene_id, cameras, options):
+    """Builds a SceneState from a /cameras response and snapshots its calibrations."""
+    snapshot_dir = args.calibration_snapshot_dir
+    camera_calibrations = build_camera_calibrations(cameras)
+
+    # Example: print calibration for each camera
+    print(f"Retrieved camera names for scene {scene_id}:")
+    for cam_name, calib in camera_calibrations.items():
+        print(f"\nCalibration for {cam_name}:")
+        print(json.dumps(calib, indent=2))
+    scene = SceneState(scene_id, camera_calibrations, **options)
+    if snapshot_dir:
+        try:
+            save_calibration_snapshot(snapshot_dir, scene)
+        except OSError as e:
+            print(f"Failed to write calibration snapshot for scene {scene_id}: {e}",
+                  file=sys.stderr)
+    return scene
+
+def setup_scene_features(args, userdata, scenes, publisher, api_key, from_snapshot):
+    """Starts the optional features shared by both runtimes once the scenes are loaded.
+
+    publisher is the client summaries are published with (paho, or the
+    asyncio runtime's LoopPublisher); from_snapshot lists the scenes whose
+    calibrations came from a snapshot and still need reconciling.
+    """
+    if args.record_dir:
+        from scene_recorder import SceneRecorder
+        userdata["recorder"] = SceneRecorder(
+            args.record_dir, segment_bytes=int(args.record_segment_mb * 1024 * 1024))
+        print(f"Recording scene messages under {args.record_dir}")
+    if args.state_db:
+        from state_sink import StateSink
+        userdata["state_sink"] = StateSink(args.state_db, args.state_counts_interval,
+                                           lost_seconds=args.track_ttl)
+        print(f"Writing state transitions to {args.state_db}")
+    if args.shard_processes > 0:
+        userdata["shard_pool"] = ShardPool(args.shard_processes, args, scenes.values())
+        print(f"Sharding people across {args.shard_processes} processes")
+    if args.tracker_snapshot_dir:
+        restore_tracker_snapshots(args, scenes)
+        if args.tracker_snapshot_interval > 0:
+            userdata["tracker_snapshotter"] = TrackerSnapshotter(
+                args.tracker_snapshot_dir, args.tracker_snapshot_interval)
+            print(f"Snapshotting tracker state every {args.tracker_snapshot_interval:g}s "
+                  f"to {args.tracker_snapshot_dir}")
+
+    if args.max_publish_rate > 0:
+        flusher = PublishFlusher()
+        for scene in scenes.values():
+            scene.publish_scheduler = PublishScheduler(
+                args.max_publish_rate,
+                functools.partial(publish_summary, publisher, userdata, scene), flusher)
+        print(f"Publishing at most {args.max_publish_rate:g} summaries per second per scene")
+
+    if args.frame_budget_ms > 0:
+        for scene in scenes.values():
+            scene.load_shedder = LoadShedder(args.frame_budget_ms / 1000.0,
+                                             args.walk_velocity_threshold, args.max_decimation)
+        print(f"Shedding fast-moving people beyond a {args.frame_budget_ms:g} ms frame budget")
+
+    if args.calibration_refresh > 0 or from_snapshot:
+        shard_pool = userdata.get("shard_pool")
+        snapshot_dir = args.calibration_snapshot_dir
+        def on_calibration_change(scene, changed):
+            if shard_pool is not None:
+                shard_pool.set_calibrations(scene.scene_id, scene.camera_calibrations)
+            if snapshot_dir:
+                # The reload itself succeeded; a failed write only costs the next cold start
+                try:
+                    save_calibration_snapshot(snapshot_dir, scene)
+                except OSError as e:
+                    print(f"Failed to write calibration snapshot for scene {scene.scene_id}: {e}",
+                          file=sys.stderr)
+        refresher = CalibrationRefresher(args.resturl, api_key, args.insecure, scenes,
+                                         args.calibration_refresh, on_calibration_change,
+                                         reconcile=from_snapshot)
+        userdata["calibration_refresher"] = refresher
+        refresher.start()
+        if args.calibration_refresh > 0:
+            print(f"Re-polling camera calibrations every {args.calibration_refresh:g}s")
+
+    register_metrics(userdata["metrics"], userdata)
+    if args.metrics_port:
+        serve_metrics(userdata["metrics"], args.metrics_port)
+        print(f"Serving Prometheus metrics on port {args.metrics_port} at /metrics")
+    if args.stats_interval > 0:
+        threading.Thread(target=stats_publisher, args=(publisher, userdata, args.stats_interval),
+                         name="stats-publisher", daemon=True).start()
 
 def main():
+    started_at = time.time()
     args = parse_args()
+    if args.runtime == "asyncio":
+        import asyncio
+        from detect_falls_async import run
+        asyncio.run(run(args, started_at))
+        return
     print(f"Looking for controller.auth at: {args.controller_auth}")
     print(f"Current working directory: {os.getcwd()}")
 
@@ -399,16 +2388,32 @@ def main():
     print(f"Using API key: {api_key[:6]}...")
 
     print(f"Scene controller: {args.broker}")
-    print(f"Scene UUID: {args.scene_uuid}")
     print(f"Insecure mode: {args.insecure}")
 
-    mqtt_topic = f"scenescape/regulated/scene/{args.scene_uuid}"
-    api_url = f"{args.resturl}/cameras?scene={args.scene_uuid}"
+    scene_ids = get_served_scene_ids(args, api_key)
+    print(f"Scene UUIDs: {', '.join(scene_ids)}")
+
+    mqtt_topic, keyframe_topic = scene_topics(args, scene_ids)
     print(f"MQTT topic: {mqtt_topic}")
-    print(f"API URL: {api_url}")
 
-    cameras = get_cameras(api_url, api_key, args.insecure)
-    if cameras is None:
+    options = projection_options(args)
+    if options["grid_spec"] is not None:
+        (x0, y0), (x1, y1) = options["grid_spec"][0]
+        print(f"Using canonical grids over {x1 - x0:.2f} x {y1 - y0:.2f} m "
+              f"with {options['grid_spec'][1]:g} m cells")
+    if options["bbox_cache_spec"] is not None:
+        print(f"Caching up to {args.canonical_cache_size} canonical boxes per camera "
+              f"at {args.canonical_cache_cm:g} cm resolution")
+    scenes = {}
+    from_snapshot = []
+    for scene_id in scene_ids:
+        scene, restored = load_scene(args, scene_id, api_key, options)
+        if scene is not None:
+            scenes[scene_id] = scene
+            if restored:
+                from_snapshot.append(scene_id)
+
+    if not scenes:
         print(
             "Failed to retrieve cameras. Will keep running for debugging.", file=sys.stderr)
         # Instead of exiting, enter a wait loop for debugging
@@ -420,47 +2425,51 @@ def main():
             print("Exiting on user request.")
             sys.exit(1)
 
-    camera_calibrations = {}
-    if isinstance(cameras, dict) and "results" in cameras:
-        camera_list = cameras["results"]
-    else:
-        camera_list = cameras
-
-    print("Retrieved camera names:")
-    for cam in camera_list:
-        name = cam.get('name', cam.get('uid', 'unknown'))
-        intrinsics = cam.get("intrinsics") or {}
-        cx = intrinsics.get("cx")
-        cy = intrinsics.get("cy")
-        resolution = [2 * cx, 2 * cy] if cx and cy else cam.get("resolution")
-        camera_calibrations[name] = {
-            "extrinsics": {
-                "translation": cam.get("translation"),
-                "rotation": cam.get("rotation"),
-                "scale": cam.get("scale"),
-            },
-            "intrinsics": intrinsics,
-            "distortion": cam.get("distortion"),
-            "resolution": resolution,
-        }
-
-    # Example: print calibration for each camera
-    for cam_name, calib in camera_calibrations.items():
-        print(f"\nCalibration for {cam_name}:")
-        print(json.dumps(calib, indent=2))
-
     sys.stdout.flush()
 
     userdata = {
+        "recorder": None,
         "mqtt_topic": mqtt_topic,
-        "camera_calibrations": camera_calibrations,
-        "scene_id": args.scene_uuid,
+        "keyframe_topic": keyframe_topic,
+        "scenes": scenes,
+        "ignored_scenes": set(),
+        "codec": JsonCodec(args.json_backend, args.selective_decode),
+        "metrics": MetricsRegistry(),
+        "profiler": SamplingProfiler(args.profile_dir, args.profile_interval_ms / 1000.0),
+        "started_at": started_at,
         "args": args
     }
+    print(f"JSON backend: {userdata['codec'].backend}")
+
     mqtt_client = initialize_mqtt_client(userdata=userdata)
     mqtt_client.on_connect = on_connect
     mqtt_client.on_message = on_message
 
+    if args.workers > 0:
+        frame_queue = FrameQueue(args.queue_scenes)
+        userdata["frame_queue"] = frame_queue
+        for i in range(args.workers):
+            threading.Thread(target=processing_worker, args=(mqtt_client, userdata, frame_queue),
+                             name=f"fall-detection-worker-{i}", daemon=True).start()
+        print(f"Started {args.workers} processing worker(s)")
+
+    setup_scene_features(args, userdata, scenes, mqtt_client, api_key, from_snapshot)
+
+    profiler = userdata["profiler"]
+    if args.workers == 0:
+        # Inline processing happens on the MQTT network thread, i.e. this one
+        profiler.register_current_thread()
+    if hasattr(signal, "SIGUSR1"):
+        def on_profile_signal(signum, frame):
+            if profiler.start(args.profile_signal_seconds):
+                print(f"SIGUSR1: profiling processing for {args.profile_signal_seconds:g}s")
+            else:
+                print("SIGUSR1: a profile is already in progress")
+        signal.signal(signal.SIGUSR1, on_profile_signal)
+    if args.profile_seconds > 0:
+        profiler.start(args.profile_seconds)
+        print(f"Profiling processing for {args.profile_seconds:g}s into {args.profile_dir}")
+
     try:
         with open(args.controller_auth, "r") as f:
             print(f"Successfully opened {args.controller_auth}")
@@ -0,0 +1,267 @@
+"""Asyncio runtime for detect_falls.py, selected with --runtime asyncio.
+
+The scene list and camera fetches for every scene (with an async HTTP
+client), the auth file and the broker connection run concurrently at
+startup, and all of them are cancelled on shutdown. Each scene is then
+processed by its own task, which hands frames to a worker thread so numpy
+never runs on the event loop; the snapshot, decoding, feature,
+classification and publishing code is the one in detect_falls.py. A lost
+broker connection is re-established after --reconnect-delay seconds without
+touching tracker state.
+
+Requires the optional aiomqtt and httpx packages.
+"""
+import asyncio
+import json
+import os
+import signal
+import ssl
+import sys
+import time
+import types
+
+import detect_falls as df
+
+try:
+    import aiomqtt
+    import httpx
+except ImportError:
+    aiomqtt = None
+    httpx = None
+
+class SceneFrames:
+    """Latest unprocessed frame per scene, owned by the event loop.
+
+    Same contract as detect_falls.FrameQueue: a newer frame replaces one that
+    is still waiting and counts as dropped, and frames for new scenes beyond
+    max_scenes are rejected.
+    """
+
+    def __init__(self, max_scenes):
+        self.max_scenes = max_scenes
+        self.dropped = 0
+        self.rejected = 0
+        self._pending = {}
+        self._events = {}
+
+    def put(self, scene_id, payload):
+        if scene_id in self._pending:
+            self.dropped += 1
+        elif len(self._pending) >= self.max_scenes:
+            self.rejected += 1
+            return
+        self._pending[scene_id] = payload
+        event = self._events.get(scene_id)
+        if event is not None:
+            event.set()
+
+    async def get(self, scene_id):
+        event = self._events.setdefault(scene_id, asyncio.Event())
+        while scene_id not in self._pending:
+            event.clear()
+            await event.wait()
+        return self._pending.pop(scene_id)
+
+class LoopPublisher:
+    """Thread-safe publish() that forwards to the current aiomqtt client.
+
+    Stands in for the paho client in publish_summary, the rate limiter's
+    timers and the stats thread. Publishes while disconnected are counted
+    in `failed` and dropped.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.client = None
+        self.failed = 0
+
+    def publish(self, topic, payload):
+        client = self.client
+        if client is None:
+            self.failed += 1
+            return
+        future = asyncio.run_coroutine_threadsafe(client.publish(topic, payload), self.loop)
+        future.add_done_callback(self._check)
+
+    def _check(self, future):
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+
+async def fetch_json(http, url, what, retries=5, delay=5):
+    for attempt in range(1, retries + 1):
+        try:
+            response = await http.get(url)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            df.log_fetch_failure(what, attempt, retries, delay, e)
+            if attempt < retries:
+                await asyncio.sleep(delay)
+    return None
+
+async def get_served_scene_ids(http, args):
+    """detect_falls.get_served_scene_ids over the async HTTP client."""
+    if not args.all_scenes:
+        return args.scene_uuid
+    # With snapshots to fall back on, don't sit through the retries
+    snapshot_ids = df.list_calibration_snapshots(args.calibration_snapshot_dir)
+    scene_ids = []
+    api_url = f"{args.resturl}/scenes"
+    while api_url:
+        scenes = await fetch_json(http, api_url, "scenes", retries=1 if snapshot_ids else 5)
+        if scenes is None:
+            return snapshot_ids
+        page_ids, api_url = df.parse_scene_page(scenes)
+        scene_ids.extend(page_ids)
+    print(f"Retrieved {len(scene_ids)} scenes from API.")
+    return scene_ids or snapshot_ids
+
+async def load_scene(http, args, scene_id, options):
+    """detect_falls.load_scene over the async HTTP client.
+
+    Snapshot files and projection setup are short blocking work and run on
+    worker threads; only the REST requests, which can retry for over a
+    minute, stay on the loop where shutdown can cancel them.
+    """
+    scene = await asyncio.to_thread(df.scene_from_snapshot, args, scene_id, options)
+    if scene is not None:
+        return scene, True
+    api_url = f"{args.resturl}/cameras?scene={scene_id}"
+    print(f"API URL: {api_url}")
+    cameras = await fetch_json(http, api_url, "cameras")
+    if cameras is None:
+        print(f"Failed to retrieve cameras for scene {scene_id}.", file=sys.stderr)
+        return None, False
+    return await asyncio.to_thread(df.scene_from_cameras, args, scene_id, cameras, options), False
+
+def read_auth(path):
+    with open(path, "r") as f:
+        print(f"Successfully opened {path}")
+        return json.load(f)
+
+async def mqtt_session(args, userdata, publisher, topics, ready):
+    """Connects, subscribes and feeds messages to on_message, reconnecting on errors.
+
+    The connection comes up while the scene list is fetched. It subscribes
+    once the `topics` future holds the (scene, keyframe request) topics and
+    consumes messages once `ready` is set, i.e. the scenes are loaded.
+    """
+    auth = await asyncio.to_thread(read_auth, args.controller_auth)
+    tls_context = ssl.create_default_context()
+    tls_context.check_hostname = False
+    tls_context.verify_mode = ssl.CERT_NONE
+    while True:
+        try:
+            print(f"Connecting to MQTT broker at {args.broker}:{args.port} ...")
+            async with aiomqtt.Client(args.broker, args.port, username=auth["user"],
+                                      password=auth["password"], tls_context=tls_context,
+                                      tls_insecure=True, keepalive=60) as client:
+                print("Connected to MQTT broker.")
+                for topic in await topics:
+                    if topic:
+                        print(f"Subscribing to topic: {topic}")
+                        await client.subscribe(topic)
+                await ready.wait()
+                publisher.client = client
+                async for message in client.messages:
+                    df.on_message(publisher, userdata, types.SimpleNamespace(
+                        topic=message.topic.value, payload=message.payload))
+        except aiomqtt.MqttError as e:
+            print(f"MQTT connection error: {e}", file=sys.stderr)
+        finally:
+            publisher.client = None
+        print(f"Reconnecting in {args.reconnect_delay:g}s")
+        await asyncio.sleep(args.reconnect_delay)
+
+def handle_in_worker(publisher, userdata, scene, payload):
+    userdata["profiler"].register_current_thread()
+    df.handle_scene_payload(publisher, userdata, scene, payload)
+
+async def process_scene(publisher, userdata, frames, scene):
+    """Processes one scene's frames in order, one at a time, off the loop."""
+    while True:
+        payload = await frames.get(scene.scene_id)
+        await asyncio.to_thread(handle_in_worker, publisher, userdata, scene, payload)
+
+async def run(args, started_at):
+    if aiomqtt is None or httpx is None:
+        print("--runtime asyncio requires the aiomqtt and httpx packages "
+              "(pip install aiomqtt httpx)", file=sys.stderr)
+        sys.exit(1)
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, main_task.cancel)
+
+    api_key = os.environ.get("SCENESCAPE_API_KEY")
+    print(f"Using API key: {api_key[:6]}...")
+    frames = SceneFrames(args.queue_scenes)
+    userdata = {
+        "recorder": None,
+        "mqtt_topic": None,
+        "keyframe_topic": None,
+        "scenes": {},
+        "ignored_scenes": set(),
+        "frame_queue": frames,
+        "codec": df.JsonCodec(args.json_backend, args.selective_decode),
+        "metrics": df.MetricsRegistry(),
+        "profiler": df.SamplingProfiler(args.profile_dir, args.profile_interval_ms / 1000.0),
+        "started_at": started_at,
+        "args": args
+    }
+    publisher = LoopPublisher(loop)
+    tasks = []
+    try:
+        # The broker connection comes up while the scenes are being fetched
+        topics = loop.create_future()
+        ready = asyncio.Event()
+        tasks.append(asyncio.create_task(mqtt_session(args, userdata, publisher, topics, ready)))
+        options = df.projection_options(args)
+        async with httpx.AsyncClient(headers={"Authorization": f"Token {api_key}"},
+                                     verify=not args.insecure, timeout=10) as http:
+            scene_ids = await get_served_scene_ids(http, args)
+            print(f"Scene UUIDs: {', '.join(scene_ids)}")
+            userdata["mqtt_topic"], userdata["keyframe_topic"] = df.scene_topics(args, scene_ids)
+            topics.set_result((userdata["mqtt_topic"], userdata["keyframe_topic"]))
+            loaded = await asyncio.gather(*(load_scene(http, args, scene_id, options)
+                                            for scene_id in scene_ids))
+        scenes = userdata["scenes"]
+        from_snapshot = []
+        for scene, restored in loaded:
+            if scene is not None:
+                scenes[scene.scene_id] = scene
+                if restored:
+                    from_snapshot.append(scene.scene_id)
+        if not scenes:
+            print("Failed to retrieve cameras. Will keep running for debugging.", file=sys.stderr)
+            await asyncio.Event().wait()
+        print(f"Loaded {len(scenes)} scene(s) {time.time() - started_at:.2f}s after startup")
+
+        # Shard processes and snapshot restores block, keep them off the loop
+        await asyncio.to_thread(df.setup_scene_features, args, userdata, scenes, publisher,
+                                api_key, from_snapshot)
+        metrics = userdata["metrics"]
+        metrics.describe("publish_failures_total", "Publishes dropped while disconnected or failed.")
+        metrics.register_callback("publish_failures_total", lambda: publisher.failed)
+        profiler = userdata["profiler"]
+        if hasattr(signal, "SIGUSR1"):
+            loop.add_signal_handler(signal.SIGUSR1, profiler.start, args.profile_signal_seconds)
+        if args.profile_seconds > 0:
+            profiler.start(args.profile_seconds)
+
+        for scene in scenes.values():
+            tasks.append(asyncio.create_task(process_scene(publisher, userdata, frames, scene)))
+        ready.set()
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        print("Shutting down.")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if userdata.get("shard_pool") is not None:
+            userdata["shard_pool"].close()
+        if userdata.get("recorder") is not None:
+            userdata["recorder"].close()
+        if userdata.get("state_sink") is not None:
+            userdata["state_sink"].close()
@@ -0,0 +1,155 @@
+import bisect
+import threading
+
+# Upper bounds in seconds; stages range from tens of microseconds to whole frames
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect and two additions."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile q, None when empty."""
+        cumulative, _ = self.snapshot()
+        if not cumulative[-1]:
+            return None
+        i = bisect.bisect_left(cumulative, q * cumulative[-1])
+        return self.buckets[i] if i < len(self.buckets) else float("inf")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class MetricsRegistry:
+    """Stage latency histograms and labelled counters in Prometheus text format.
+
+    Counters that already live elsewhere (queue drop counts and so on) are
+    registered as callbacks and only read when the metrics are rendered.
+    """
+
+    def __init__(self, namespace="fall_detection"):
+        self.namespace = namespace
+        self.stages = {}
+        self.counters = {}
+        self.descriptions = {}
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def describe(self, name, help_text, metric_type="counter"):
+        self.descriptions[name] = (help_text, metric_type)
+
+    def observe_stage(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.stages.setdefault(stage, Histogram())
+        histogram.observe(seconds)
+
+    def observe_stages(self, timings):
+        for stage, seconds in timings.items():
+            self.observe_stage(stage, seconds)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def register_callback(self, name, read, **labels):
+        self.callbacks.append((name, tuple(sorted(labels.items())), read))
+
+    def counter_values(self):
+        with self.lock:
+            values = dict(self.counters)
+        for name, labels, read in self.callbacks:
+            values[(name, labels)] = read()
+        return values
+
+    def render(self):
+        ns = self.namespace
+        lines = [
+            f"# HELP {ns}_stage_seconds Time spent in each message processing stage.",
+            f"# TYPE {ns}_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            cumulative, total = histogram.snapshot()
+            for bound, count in zip(histogram.buckets + ("+Inf",), cumulative):
+                lines.append(f'{ns}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{ns}_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{ns}_stage_seconds_count{{stage="{stage}"}} {cumulative[-1]}')
+        by_name = {}
+        for (name, labels), value in self.counter_values().items():
+            by_name.setdefault(name, []).append((labels, value))
+        for name, samples in sorted(by_name.items()):
+            help_text, metric_type = self.descriptions.get(name, (name, "counter"))
+            lines.append(f"# HELP {ns}_{name} {help_text}")
+            lines.append(f"# TYPE {ns}_{name} {metric_type}")
+            for labels, value in sorted(samples):
+                lines.append(f"{ns}_{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, **labels):
+        """Counters matching labels plus p50/p99 stage latencies, as a dict."""
+        wanted = set(labels.items())
+        counters = {}
+        for (name, counter_labels), value in self.counter_values().items():
+            if wanted <= set(counter_labels) or not counter_labels:
+                counters[name] = counters.get(name, 0) + value
+        stages = {}
+        for stage, histogram in self.stages.items():
+            cumulative, total = histogram.snapshot()
+            stages[stage] = {
+                "count": cumulative[-1],
+                "sum_seconds": total,
+                "p50_seconds": histogram.quantile(0.5),
+                "p99_seconds": histogram.quantile(0.99),
+            }
+        return {"counters": counters, "stages": stages}
+
+def serve_metrics(registry, port, host="0.0.0.0"):
+    """Serves registry.render() at /metrics from a daemon thread."""
+    # Imported here so that processes without --metrics-port never load http.server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,361 @@
+"""Offline evaluation of fall detection parameters on a recorded scene stream.
+
+Loads a recording made with detect_falls.py --record-dir into columnar arrays
+once, computes the per-observation features with the detector's own code, and
+then replays smoothing and classification for every combination of the given
+parameter values in a process pool. Each combination gets a per-person state
+timeline and, when a labels file is given, a confusion matrix.
+
+    python3 evaluate_falls.py recordings/ --window-seconds 0.3,0.5,1 \\
+        --fallen-arr-threshold 0.5,0.6,0.7 --labels labels.csv
+
+Labels are CSV rows of uuid,state,start,end with start and end in seconds from
+the first recorded message.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+import types
+
+import numpy as np
+
+import detect_falls as df
+from scene_recorder import read_records
+
+PARAMETERS = ("window_seconds", "fallen_arr_threshold", "area_rate_threshold",
+              "walk_velocity_threshold", "run_velocity_threshold")
+
+def float_list(text):
+    return [float(value) for value in text.split(",") if value.strip()]
+
+def parse_args():
+    defaults = df.parse_args(["--scene-uuid", "-", "--broker", "-", "--resturl", "-"])
+    parser = argparse.ArgumentParser(
+        description="Sweep fall detection parameters over a recorded scene stream")
+    parser.add_argument('recording', help='Directory written by detect_falls.py --record-dir')
+    parser.add_argument('--start', type=float, default=None,
+                        help='First receive timestamp to evaluate (epoch seconds)')
+    parser.add_argument('--end', type=float, default=None,
+                        help='Last receive timestamp to evaluate (epoch seconds)')
+    parser.add_argument('--scene-uuid', type=str, action='append', default=None,
+                        help='Only evaluate this scene (repeatable; default: every recorded scene)')
+    parser.add_argument('--camera-file', type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                             "dataset", "cameras.json"),
+                        help='Camera calibrations in dataset/cameras.json format')
+    parser.add_argument('--calibration-snapshot-dir', type=str, default=None,
+                        help='Use the detector\'s calibration snapshots instead of --camera-file')
+    for name in PARAMETERS:
+        flag = "--" + name.replace("_", "-")
+        parser.add_argument(flag, type=float_list, default=[getattr(defaults, name)],
+                            help=f'Comma-separated values to sweep (default: {getattr(defaults, name):g})')
+    parser.add_argument('--history-capacity', type=int, default=None,
+                        help='Maximum samples per person and camera within the rolling window '
+                             '(default: sized from each window length, as in the detector)')
+    parser.add_argument('--labels', type=str, default=None,
+                        help='CSV of uuid,state,start,end ground truth intervals')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes for the sweep')
+    parser.add_argument('--output-dir', type=str, required=True,
+                        help='Directory for results.jsonl and the per-combination timelines')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Combinations listed in the printed summary')
+    return parser.parse_args()
+
+class Recording:
+    """Columnar person observations of a recording, sorted by (track, time).
+
+    Row i is one (person, camera) observation. features holds the detector's
+    raw feature matrix (see detect_falls.compute_frame_features); pf maps a
+    row to its person-frame, i.e. one person in one scene message, which is
+    what the consensus state and the timelines are computed over.
+    """
+    __slots__ = ("start_time", "times", "track", "features", "pf", "pf_time", "pf_uuid",
+                 "pf_order", "uuids", "labels")
+
+    def __init__(self, start_time, times, track, features, pf, pf_time, pf_uuid, uuids):
+        self.start_time = start_time
+        self.times = times
+        self.track = track
+        self.features = features
+        self.pf = pf
+        self.pf_time = pf_time
+        self.pf_uuid = pf_uuid
+        # Person-frames by person, then time, for the timelines
+        self.pf_order = np.lexsort((pf_time, pf_uuid))
+        self.uuids = uuids
+        self.labels = None
+
+def load_camera_file(path):
+    with open(path) as f:
+        cameras = json.load(f)["cameras"]
+    return {cam["name"]: {"extrinsics": cam["extrinsics"], "intrinsics": cam["intrinsics"],
+                          "distortion": cam["distortion"], "resolution": cam["resolution"]}
+            for cam in cameras}
+
+def load_recording(args):
+    """Decodes the recording once and computes the raw features of every observation."""
+    codec = df.JsonCodec()
+    frames, times, messages, scene_ids = [], [], [], set()
+    for timestamp, topic, payload in read_records(args.recording, args.start, args.end):
+        if topic.endswith(df.KEYFRAME_REQUEST_SUFFIX):
+            continue
+        scene_id = df.scene_id_from_topic(topic)
+        if args.scene_uuid and scene_id not in args.scene_uuid:
+            continue
+        frame = df.PersonFrame.from_objects(codec.decode_scene(payload).get("objects", []))
+        if not len(frame):
+            continue
+        frames.append(frame)
+        times.append(np.full(len(frame), timestamp))
+        messages.append(np.full(len(frame), len(messages)))
+        scene_ids.add(scene_id)
+    if not frames:
+        return None
+    frame = df.PersonFrame(
+        [uuid for f in frames for uuid in f.uuids], [cam for f in frames for cam in f.cam_ids],
+        [], *(np.concatenate([getattr(f, name) for f in frames])
+              for name in ("velocity", "translation", "size", "bbox")))
+    times = np.concatenate(times)
+    messages = np.concatenate(messages)
+
+    if args.calibration_snapshot_dir:
+        cache = df.CalibrationCache()
+        for scene_id in scene_ids:
+            snapshot = df.load_calibration_snapshot(args.calibration_snapshot_dir, scene_id)
+            if snapshot is not None:
+                cache.calibrations.update(snapshot.calibrations)
+                cache.cameras.update(snapshot.cameras)
+    else:
+        cache = df.CalibrationCache(load_camera_file(args.camera_file))
+    scene = types.SimpleNamespace(calibration_cache=cache)
+    cameras = df.resolve_cameras(frame, scene)
+    missing = sorted(cam_id for cam_id, rows, camera, resolution in cameras if camera is None)
+    if missing:
+        print(f"No calibration for cameras {', '.join(missing)}; their canonical aspect ratio is 1")
+    canonical = df.frame_canonical_bboxes(frame, cameras)
+    features = df.compute_frame_features(
+        frame, df.canonical_aspect_ratios(frame, canonical, cameras), cameras)
+
+    uuids, uuid_codes = np.unique(np.array(frame.uuids), return_inverse=True)
+    _, track = np.unique(np.array([f"{u}\0{c}" for u, c in zip(frame.uuids, frame.cam_ids)]),
+                         return_inverse=True)
+    _, pf_first, pf = np.unique(messages * len(uuids) + uuid_codes,
+                                return_index=True, return_inverse=True)
+    order = np.lexsort((times, track))
+    return Recording(float(times.min()), times[order], track[order], features[order],
+                     pf[order], times[pf_first], uuid_codes[pf_first], uuids)
+
+def load_labels(path, recording):
+    """Returns the labelled STATE_PRIORITY index of every person-frame, -1 where unlabelled."""
+    labels = np.full(len(recording.pf_time), -1)
+    codes = {uuid: i for i, uuid in enumerate(recording.uuids)}
+    relative = recording.pf_time - recording.start_time
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            if row["uuid"] not in codes:
+                continue
+            if row["state"] not in df.STATE_INDEX:
+                raise ValueError(f"unknown state {row['state']!r} in {path}")
+            covered = ((recording.pf_uuid == codes[row["uuid"]])
+                       & (relative >= float(row["start"])) & (relative <= float(row["end"])))
+            labels[covered] = df.STATE_INDEX[row["state"]]
+    return labels
+
+def window_starts(recording, window_seconds, capacity):
+    """First row of every row's rolling window, as the detector's HistoryStore would hold it."""
+    times = recording.times - recording.start_time
+    # Offsetting each track by more than the recording length keeps searches inside it
+    span = float(times.max()) + window_seconds + 1.0
+    key = recording.track * span + times
+    starts = np.searchsorted(key, key - window_seconds, side="left")
+    return np.maximum(starts, np.arange(len(times)) - capacity + 1)
+
+def rolling_stats(values, starts, times=None):
+    """HistoryStore.weighted_mean() of every row's window, and its slope() when times are given.
+
+    Sums are accumulated one lag at a time over all rows, so the cost is the
+    longest window times the number of rows, without any per-row Python.
+    """
+    n = np.arange(len(values)) - starts + 1
+    sum_v = np.zeros_like(values)
+    sum_kv = np.zeros_like(values)
+    if times is not None:
+        sum_d, sum_dd, sum_dv = np.zeros(len(n)), np.zeros(len(n)), np.zeros_like(values)
+    for k in range(int(n.max()) if len(n) else 0):
+        # Row i + k sees row i at lag k when its window reaches back that far
+        live = (n[k:] > k)[:, None]
+        v = np.where(live, values[:len(values) - k], 0.0)
+        sum_v[k:] += v
+        sum_kv[k:] += k * v
+        if times is not None:
+            # Times relative to the newest sample keep the sums small
+            d = np.where(live[:, 0], times[:len(times) - k] - times[k:], 0.0)
+            sum_d[k:] += d
+            sum_dd[k:] += d * d
+            sum_dv[k:] += d[:, None] * v
+    nv = n[:, None].astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Sample weights 2 - k / (n - 1) for lag k are np.linspace(1, 2, n), summing to 1.5 n
+        mean = np.where(nv > 1, (2 * sum_v - sum_kv / (nv - 1)) / (1.5 * nv), sum_v)
+        if times is None:
+            return mean, None
+        denom = (n * sum_dd - sum_d * sum_d)[:, None]
+        slope = np.where((nv > 1) & (denom > 0), (nv * sum_dv - sum_d[:, None] * sum_v) / denom, 0.0)
+    return mean, slope
+
+def smooth_features(recording, window_seconds, capacity):
+    """Returns the smoothed feature matrix the detector would classify."""
+    starts = window_starts(recording, window_seconds, capacity)
+    features = recording.features.copy()
+    area_mean, area_rate = rolling_stats(features[:, 2:3], starts, recording.times)
+    features[:, 2] = area_mean[:, 0]
+    features[:, 3] = area_rate[:, 0]
+    smoothed, _ = rolling_stats(features, starts)
+    return smoothed
+
+def consensus_states(recording, smoothed, params):
+    """Most severe state per person-frame, as process_scene_message reports it."""
+    states = df.classify_states(smoothed, types.SimpleNamespace(**params))
+    consensus = np.full(len(recording.pf_time), len(df.STATE_PRIORITY) - 1)
+    np.minimum.at(consensus, recording.pf, states)
+    return consensus
+
+def timeline_segments(recording, consensus):
+    """Yields (uuid, state, start, end) runs of equal state per person, in seconds from the start."""
+    order = recording.pf_order
+    uuid, state, t = recording.pf_uuid[order], consensus[order], recording.pf_time[order]
+    breaks = np.flatnonzero((uuid[1:] != uuid[:-1]) | (state[1:] != state[:-1])) + 1
+    for first, last in zip(np.r_[0, breaks], np.r_[breaks, len(order)] - 1):
+        yield (recording.uuids[uuid[first]], df.STATE_PRIORITY[state[first]],
+               t[first] - recording.start_time, t[last] - recording.start_time)
+
+def confusion_matrix(labels, consensus):
+    """Rows are labelled states, columns detected states, both in STATE_PRIORITY order."""
+    size = len(df.STATE_PRIORITY)
+    labelled = labels >= 0
+    return np.bincount(labels[labelled] * size + consensus[labelled],
+                       minlength=size * size).reshape(size, size)
+
+_worker = {}
+
+def init_worker(recording, output_dir, capacity):
+    _worker.update(recording=recording, output_dir=output_dir, capacity=capacity, smoothed=None)
+
+def evaluate(task):
+    """Evaluates (combination index, parameters) pairs that share one window length."""
+    results = []
+    recording = _worker["recording"]
+    for index, params in task:
+        window_seconds = params["window_seconds"]
+        if _worker["smoothed"] is None or _worker["smoothed"][0] != window_seconds:
+            capacity = _worker["capacity"] or df.default_history_capacity(window_seconds)
+            _worker["smoothed"] = (window_seconds,
+                                   smooth_features(recording, window_seconds, capacity))
+        consensus = consensus_states(recording, _worker["smoothed"][1], params)
+        falls = 0
+        path = os.path.join(_worker["output_dir"], "timelines", f"{index:04d}.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["uuid", "state", "start", "end"])
+            for uuid, state, start, end in timeline_segments(recording, consensus):
+                writer.writerow([uuid, state, f"{start:.3f}", f"{end:.3f}"])
+                falls += state == "fallen"
+        counts = np.bincount(consensus, minlength=len(df.STATE_PRIORITY))
+        result = {
+            "combination": index,
+            "params": params,
+            "state_counts": dict(zip(df.STATE_PRIORITY, counts.tolist())),
+            "fall_events": falls,
+            "timeline": os.path.relpath(path, _worker["output_dir"]),
+        }
+        if recording.labels is not None:
+            confusion = confusion_matrix(recording.labels, consensus)
+            fallen = df.STATE_INDEX["fallen"]
+            true_positive = int(confusion[fallen, fallen])
+            precision = true_positive / max(int(confusion[:, fallen].sum()), 1)
+            recall = true_positive / max(int(confusion[fallen].sum()), 1)
+            result.update({
+                "confusion": confusion.tolist(),
+                "accuracy": float(np.trace(confusion) / max(confusion.sum(), 1)),
+                "fallen_precision": precision,
+                "fallen_recall": recall,
+                "fallen_f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            })
+        results.append(result)
+    return results
+
+def sweep_tasks(args, processes):
+    """Splits the parameter grid into tasks of one window length each.
+
+    Every window's combinations are cut into about `processes` chunks so a
+    single window still keeps the pool busy; a worker smooths each window it
+    is handed once.
+    """
+    combos = [dict(zip(PARAMETERS, values))
+              for values in itertools.product(*(getattr(args, name) for name in PARAMETERS))]
+    indexed = list(enumerate(combos))
+    tasks = []
+    for window_seconds in args.window_seconds:
+        group = [item for item in indexed if item[1]["window_seconds"] == window_seconds]
+        size = -(-len(group) // processes)
+        tasks.extend(group[i:i + size] for i in range(0, len(group), size))
+    return combos, tasks
+
+def print_summary(results, top, labelled):
+    ranked = sorted(results, key=lambda r: r["fallen_f1"], reverse=True) if labelled else results
+    header = "".join(f"{name:>24}" for name in PARAMETERS)
+    print(f"{'#':>5}{header}{'fall events':>13}" + (f"{'accuracy':>10}{'fallen F1':>11}" if labelled else ""))
+    for r in ranked[:top]:
+        line = f"{r['combination']:>5}" + "".join(f"{r['params'][name]:>24g}" for name in PARAMETERS)
+        line += f"{r['fall_events']:>13}"
+        if labelled:
+            line += f"{r['accuracy']:>10.3f}{r['fallen_f1']:>11.3f}"
+        print(line)
+    if labelled and ranked:
+        best = ranked[0]
+        print(f"\nConfusion matrix of combination {best['combination']} (rows labelled, columns detected):")
+        print(" " * 10 + "".join(f"{state:>10}" for state in df.STATE_PRIORITY))
+        for state, row in zip(df.STATE_PRIORITY, best["confusion"]):
+            print(f"{state:>10}" + "".join(f"{count:>10}" for count in row))
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    recording = load_recording(args)
+    if recording is None:
+        print(f"No person observations recorded in {args.recording}", file=sys.stderr)
+        sys.exit(1)
+    if args.labels:
+        recording.labels = load_labels(args.labels, recording)
+    print(f"Loaded {len(recording.times)} observations of {len(recording.uuids)} people "
+          f"in {time.perf_counter() - started:.2f}s")
+
+    processes = max(1, args.processes)
+    combos, tasks = sweep_tasks(args, processes)
+    os.makedirs(os.path.join(args.output_dir, "timelines"), exist_ok=True)
+    started = time.perf_counter()
+    initargs = (recording, args.output_dir, args.history_capacity)
+    if processes == 1 or len(tasks) == 1:
+        init_worker(*initargs)
+        batches = list(map(evaluate, tasks))
+    else:
+        import multiprocessing
+        with multiprocessing.get_context("spawn").Pool(
+                min(processes, len(tasks)), initializer=init_worker, initargs=initargs) as pool:
+            batches = list(pool.imap_unordered(evaluate, tasks))
+    results = sorted((r for batch in batches for r in batch), key=lambda r: r["combination"])
+    print(f"Evaluated {len(combos)} parameter combinations in {time.perf_counter() - started:.2f}s")
+
+    with open(os.path.join(args.output_dir, "results.jsonl"), "w") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    print_summary(results, args.top, recording.labels is not None)
+    print(f"\nResults and timelines written to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import bisect
+import glob
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+# A segment file is a sequence of zlib-compressed blocks. Each block holds
+# records of RECORD_HEADER (receive timestamp, topic length, payload length)
+# followed by the topic and payload bytes. The matching .idx file holds one
+# INDEX_ENTRY (first timestamp, last timestamp, offset, length, record count)
+# per block so a time range can be located without decompressing anything.
+RECORD_HEADER = struct.Struct("<dHI")
+INDEX_ENTRY = struct.Struct("<ddQII")
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+
+class SceneRecorder:
+    """Writes raw scene messages to size-rotated, block-compressed segments.
+
+    record() only enqueues, so the caller (the MQTT network thread) never
+    waits on compression or disk. Messages arriving while the queue is full
+    are counted in `dropped` instead of blocking.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024,
+                 block_bytes=256 * 1024, block_seconds=1.0, queue_size=10000):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.block_bytes = block_bytes
+        self.block_seconds = block_seconds
+        self.dropped = 0
+        self.recorded = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._segment = None
+        self._index = None
+        self._block = bytearray()
+        self._block_count = 0
+        self._block_first = None
+        self._block_last = None
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="scene-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, topic, payload, timestamp=None):
+        try:
+            self._queue.put_nowait((timestamp or time.time(), topic, payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.block_seconds)
+            except queue.Empty:
+                self._flush_block()
+                continue
+            if item is None:
+                break
+            timestamp, topic, payload = item
+            topic = topic.encode("utf-8")
+            self._block += RECORD_HEADER.pack(timestamp, len(topic), len(payload))
+            self._block += topic
+            self._block += payload
+            self._block_count += 1
+            if self._block_first is None:
+                self._block_first = timestamp
+            self._block_last = timestamp
+            self.recorded += 1
+            if (len(self._block) >= self.block_bytes
+                    or timestamp - self._block_first >= self.block_seconds):
+                self._flush_block()
+        self._flush_block()
+        self._close_segment()
+
+    def _flush_block(self):
+        if not self._block_count:
+            return
+        if self._segment is None:
+            self._open_segment(self._block_first)
+        data = zlib.compress(bytes(self._block), 6)
+        offset = self._segment.tell()
+        self._segment.write(data)
+        self._segment.flush()
+        self._index.write(INDEX_ENTRY.pack(
+            self._block_first, self._block_last, offset, len(data), self._block_count))
+        self._index.flush()
+        self._block.clear()
+        self._block_count = 0
+        self._block_first = None
+        self._block_last = None
+        if self._segment.tell() >= self.segment_bytes:
+            self._close_segment()
+
+    def _open_segment(self, timestamp):
+        base = os.path.join(self.directory, f"scene-{int(timestamp * 1000):013d}")
+        self._segment = open(base + SEGMENT_SUFFIX, "ab")
+        self._index = open(base + INDEX_SUFFIX, "ab")
+        print(f"Recording scene messages to {base + SEGMENT_SUFFIX}")
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = None
+            self._index = None
+
+def load_index(index_path):
+    with open(index_path, "rb") as f:
+        data = f.read()
+    usable = len(data) - len(data) % INDEX_ENTRY.size
+    return list(INDEX_ENTRY.iter_unpack(data[:usable]))
+
+def list_segments(directory):
+    return sorted(glob.glob(os.path.join(directory, "scene-*" + SEGMENT_SUFFIX)))
+
+def read_records(directory, start=None, end=None):
+    """Yields (timestamp, topic, payload) for recorded messages in [start, end].
+
+    Blocks outside the range are skipped using the per-segment index.
+    """
+    start = float("-inf") if start is None else start
+    end = float("inf") if end is None else end
+    for segment_path in list_segments(directory):
+        index_path = segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+        if not os.path.exists(index_path):
+            continue
+        index = load_index(index_path)
+        if not index or index[-1][1] < start or index[0][0] > end:
+            continue
+        # Block last timestamps are non-decreasing; skip blocks ending before start
+        first = bisect.bisect_left([entry[1] for entry in index], start)
+        with open(segment_path, "rb") as f:
+            for first_ts, last_ts, offset, length, count in index[first:]:
+                if first_ts > end:
+                    break
+                f.seek(offset)
+                block = zlib.decompress(f.read(length))
+                pos = 0
+                for _ in range(count):
+                    timestamp, topic_len, payload_len = RECORD_HEADER.unpack_from(block, pos)
+                    pos += RECORD_HEADER.size
+                    topic = block[pos:pos + topic_len].decode("utf-8")
+                    pos += topic_len
+                    payload = block[pos:pos + payload_len]
+                    pos += payload_len
+                    if start <= timestamp <= end:
+                        yield timestamp, topic, payload
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Dump scene messages recorded by detect_falls.py --record-dir")
+    parser.add_argument('directory', help='Recording directory')
+    parser.add_argument('--start', type=float, default=None,
+                        help='First receive timestamp to dump (epoch seconds)')
+    parser.add_argument('--end', type=float, default=None,
+                        help='Last receive timestamp to dump (epoch seconds)')
+    args = parser.parse_args()
+
+    for timestamp, topic, payload in read_records(args.directory, args.start, args.end):
+        sys.stdout.write(json.dumps({
+            "timestamp": timestamp,
+            "topic": topic,
+            "payload": json.loads(payload),
+        }) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import datetime
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+# transitions holds one row per change of a person's reported state, with the
+# time the new state started; "lost" marks a person no longer reported.
+# state_counts holds a scene's summary counts every counts_interval seconds.
+# The indexes serve the queries below: by state and time (optionally one
+# scene), by person within a scene, and by scene and time.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transitions (
+    scene_id TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    time REAL NOT NULL,
+    state TEXT NOT NULL,
+    previous TEXT
+);
+CREATE INDEX IF NOT EXISTS transitions_state_time ON transitions (state, time, scene_id);
+DROP INDEX IF EXISTS transitions_uuid_time;
+CREATE INDEX IF NOT EXISTS transitions_scene_uuid_time ON transitions (scene_id, uuid, time);
+CREATE INDEX IF NOT EXISTS transitions_scene_time ON transitions (scene_id, time);
+CREATE TABLE IF NOT EXISTS state_counts (
+    scene_id TEXT NOT NULL,
+    time REAL NOT NULL,
+    fallen INTEGER NOT NULL,
+    falling INTEGER NOT NULL,
+    running INTEGER NOT NULL,
+    walking INTEGER NOT NULL,
+    standing INTEGER NOT NULL,
+    unknown INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS state_counts_scene_time ON state_counts (scene_id, time);
+"""
+COUNT_STATES = ("fallen", "falling", "running", "walking", "standing", "unknown")
+LOST = "lost"
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+class StateSink:
+    """Writes per-person state transitions and periodic state counts to SQLite.
+
+    record() only enqueues the summary message, so the processing thread
+    never waits on the database. The sink thread diffs each person's state
+    against the last one it wrote and commits the rows in one transaction per
+    batch_seconds. Messages arriving while the queue is full are counted in
+    `dropped`. A person not reported for lost_seconds gets a "lost" row, which
+    closes their last state.
+    """
+
+    def __init__(self, path, counts_interval=10.0, batch_seconds=1.0, lost_seconds=60.0,
+                 queue_size=10000):
+        self.path = path
+        self.counts_interval = counts_interval
+        self.batch_seconds = batch_seconds
+        self.lost_seconds = lost_seconds
+        self.dropped = 0
+        self.rows_written = 0
+        self.failures = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        # {(scene_id, uuid): [state, last reported]}
+        self._states = {}
+        self._last_counts = {}
+        self._transitions = []
+        self._counts = []
+        connect(path).close()
+        self._thread = threading.Thread(target=self._run, name="state-sink", daemon=True)
+        self._thread.start()
+
+    def record(self, scene_id, message, timestamp=None):
+        try:
+            self._queue.put_nowait((timestamp or time.time(), scene_id, message))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        db = connect(self.path)
+        next_flush = time.time() + self.batch_seconds
+        while True:
+            try:
+                item = self._queue.get(timeout=max(next_flush - time.time(), 0.0))
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self._add(*item)
+            if time.time() >= next_flush:
+                self._expire(time.time())
+                self._flush(db)
+                next_flush = time.time() + self.batch_seconds
+        self._flush(db)
+        db.close()
+
+    def _add(self, now, scene_id, message):
+        for person in message["people"]:
+            key = (scene_id, person["uuid"])
+            known = self._states.get(key)
+            if known is None or known[0] != person["state"]:
+                self._transitions.append((scene_id, person["uuid"],
+                                          now - person.get("state_duration", 0.0),
+                                          person["state"], known[0] if known else None))
+                self._states[key] = [person["state"], now]
+            else:
+                known[1] = now
+        if now - self._last_counts.get(scene_id, 0.0) >= self.counts_interval:
+            self._last_counts[scene_id] = now
+            counts = message["state_counts"]
+            self._counts.append((scene_id, now, *(counts.get(state, 0) for state in COUNT_STATES)))
+
+    def _expire(self, now):
+        for key, (state, last_seen) in list(self._states.items()):
+            if now - last_seen > self.lost_seconds:
+                del self._states[key]
+                self._transitions.append((*key, last_seen, LOST, state))
+
+    def _flush(self, db):
+        if not self._transitions and not self._counts:
+            return
+        try:
+            with db:
+                db.executemany("INSERT INTO transitions VALUES (?, ?, ?, ?, ?)", self._transitions)
+                db.executemany("INSERT INTO state_counts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._counts)
+            self.rows_written += len(self._transitions) + len(self._counts)
+        except sqlite3.Error as e:
+            self.failures += 1
+            print(f"Failed to write {len(self._transitions) + len(self._counts)} rows to "
+                  f"{self.path}: {e}", file=sys.stderr)
+        self._transitions = []
+        self._counts = []
+
+def scene_filter(scene_id, column="scene_id"):
+    return (f" AND {column} = ?", [scene_id]) if scene_id else ("", [])
+
+def falls_per_hour(db, start=None, end=None, scene_id=None):
+    """Returns [(hour start, falls)] of transitions into fallen in [start, end]."""
+    where, params = scene_filter(scene_id)
+    return db.execute(
+        "SELECT CAST(time / 3600 AS INTEGER) * 3600 AS hour, COUNT(*) FROM transitions "
+        f"WHERE state = 'fallen' AND time BETWEEN ? AND ?{where} GROUP BY hour ORDER BY hour",
+        [start or 0.0, end or time.time(), *params]).fetchall()
+
+def longest_fallen(db, start=None, end=None, scene_id=None, limit=10):
+    """Returns [(scene_id, uuid, fell at, seconds fallen)] of the longest falls in [start, end].
+
+    A fall lasts until the person's next transition in the same scene, or
+    until now if they are still reported as fallen.
+    """
+    where, params = scene_filter(scene_id, "t.scene_id")
+    return db.execute(
+        "SELECT t.scene_id, t.uuid, t.time, "
+        "COALESCE((SELECT MIN(n.time) FROM transitions n "
+        "WHERE n.scene_id = t.scene_id AND n.uuid = t.uuid AND n.time > t.time), ?)"
+        " - t.time AS duration FROM transitions t "
+        f"WHERE t.state = 'fallen' AND t.time BETWEEN ? AND ?{where} "
+        "ORDER BY duration DESC LIMIT ?",
+        [time.time(), start or 0.0, end or time.time(), *params, limit]).fetchall()
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Query the state database written by detect_falls.py --state-db")
+    parser.add_argument('database', help='SQLite database path')
+    parser.add_argument('query', choices=['falls-per-hour', 'longest-fallen'])
+    parser.add_argument('--scene-uuid', type=str, default=None, help='Only this scene')
+    parser.add_argument('--start', type=float, default=None,
+                        help='Earliest transition time (epoch seconds)')
+    parser.add_argument('--end', type=float, default=None,
+                        help='Latest transition time (epoch seconds)')
+    parser.add_argument('--limit', type=int, default=10,
+                        help='Rows listed by longest-fallen')
+    args = parser.parse_args()
+
+    db = sqlite3.connect(f"file:{args.database}?mode=ro", uri=True)
+    if args.query == "falls-per-hour":
+        for hour, falls in falls_per_hour(db, args.start, args.end, args.scene_uuid):
+            print(f"{format_time(hour)}  {falls}")
+    else:
+        for scene_id, uuid, fell_at, duration in longest_fallen(
+                db, args.start, args.end, args.scene_uuid, args.limit):
+            print(f"{format_time(fell_at)}  {duration:9.1f}s  {uuid}  (scene {scene_id})")
+
+if __name__ == "__main__":
+    main()